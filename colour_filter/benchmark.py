@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+'''
+    benchmark - measure the throughput of colour-filter on synthetic logs
+
+    The logs are generated with a controlled number of lines, line length,
+    fraction of lines that match and number of patterns. Each log is coloured
+    by ColourFilter.filterLines, ColourFilter.filterBlocks and the
+    colour-filter command and the results are saved as JSON so that two runs
+    can be compared.
+'''
+import sys
+import os
+import json
+import time
+import random
+import platform
+import tempfile
+import subprocess
+
+# the patterns used by the benchmarks, the first N are used for a
+# benchmark with N patterns. Each pattern matches the word with the same index
+# in all_match_words
+all_benchmark_patterns = [
+    ('ERROR', 'red'),
+    (r'WARN\w*', 'yellow'),
+    ('^Info:', 'green'),
+    (r'timeout=\d+', 'magenta'),
+    (r'user=\w+', 'cyan'),
+    (r'(?i)fail(ed|ure)', 'red'),
+    (r'\bretry\b', 'blue'),
+    (r'status=5\d\d', 'lightred'),
+    ]
+all_match_words = [
+    'ERROR',
+    'WARNING',
+    'Info:',
+    'timeout=30',
+    'user=fred',
+    'FAILED',
+    'retry',
+    'status=503',
+    ]
+all_plain_words = ['the', 'request', 'handled', 'in', 'ms', 'connection', 'from', 'host', 'queue', 'worker', 'ok', 'done']
+
+# name, lines, line length, match density, pattern count
+all_benchmarks = [
+    ('short-dense',     200000,  60, 0.5,  3),
+    ('short-sparse',    200000,  60, 0.01, 3),
+    ('long-dense',       50000, 400, 0.5,  3),
+    ('many-patterns',   200000,  80, 0.2,  8),
+    ('no-matches',      200000,  80, 0.0,  3),
+    ]
+
+def usage():
+    print( '''Usage: benchmark.py <options>
+
+Options:
+    --quick                 - use a tenth of the lines
+    --repeat <count>        - best of <count> runs of each benchmark, default 3
+    --output <file>         - save the results as JSON in <file>
+    --compare <file>        - compare the results with the JSON results in <file>
+    --cli-only              - only benchmark the colour-filter command
+    --library-only          - only benchmark the ColourFilter class
+''' )
+
+def main( argv ):
+    opt_quick = False
+    opt_repeat = 3
+    opt_output = None
+    opt_compare = None
+    opt_cli = True
+    opt_library = True
+
+    args = iter( argv[1:] )
+    try:
+        for arg in args:
+            if arg == '--quick':
+                opt_quick = True
+
+            elif arg == '--repeat':
+                opt_repeat = int( next( args ) )
+
+            elif arg == '--output':
+                opt_output = next( args )
+
+            elif arg == '--compare':
+                opt_compare = next( args )
+
+            elif arg == '--cli-only':
+                opt_library = False
+
+            elif arg == '--library-only':
+                opt_cli = False
+
+            elif arg in ('-h', '--help'):
+                usage()
+                return 0
+
+            else:
+                print( 'Error: Unknown option %s' % (arg,) )
+                return 1
+
+    except (StopIteration, ValueError):
+        print( 'Error: Need more args' )
+        return 1
+
+    # benchmark the colour_filter next to this script
+    package_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    src_dir = os.path.join( package_dir, 'src' )
+    sys.path.insert( 0, src_dir )
+    # the colour-filter command imports colour_text, in a source tree it is a sibling package
+    colour_text_src_dir = os.path.join( os.path.dirname( package_dir ), 'colour_text', 'src' )
+    import colour_filter
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'colour_filter': colour_filter.VERSION,
+        'date': time.strftime( '%Y-%m-%d %H:%M:%S' ),
+        'benchmarks': {},
+        }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict( os.environ )
+        env['PYTHONPATH'] = os.pathsep.join( [src_dir, colour_text_src_dir] + sys.path[1:] )
+        # no schemes from the user's config
+        env['XDG_CONFIG_HOME'] = tmp_dir
+
+        if opt_cli:
+            results['startup_seconds'] = startupLatency( env, opt_repeat )
+            print( 'startup %.1fms' % (results['startup_seconds'] * 1000,) )
+
+        for name, lines, line_length, density, pattern_count in all_benchmarks:
+            if opt_quick:
+                lines //= 10
+
+            log_filename = os.path.join( tmp_dir, '%s.log' % (name,) )
+            makeLog( log_filename, lines, line_length, density, pattern_count )
+            size = os.path.getsize( log_filename )
+            all_patterns = all_benchmark_patterns[0:pattern_count]
+
+            benchmark = {'lines': lines, 'line_length': line_length, 'density': density
+                        ,'patterns': pattern_count, 'bytes': size}
+
+            if opt_library:
+                for method in ('filterLines', 'filterBlocks'):
+                    seconds = bestOf( opt_repeat, lambda: runLibrary( colour_filter, method, all_patterns, log_filename ) )
+                    benchmark[ method ] = rates( lines, size, seconds )
+
+            if opt_cli:
+                all_runs = [runCli( env, all_patterns, log_filename ) for repeat in range( opt_repeat )]
+                benchmark['cli'] = rates( lines, size, min( seconds for seconds, max_rss in all_runs ) )
+                benchmark['cli']['peak_rss_kb'] = max( max_rss for seconds, max_rss in all_runs )
+
+            results['benchmarks'][ name ] = benchmark
+            report( name, benchmark )
+
+    if opt_output is not None:
+        with open( opt_output, 'w' ) as f:
+            json.dump( results, f, indent=4 )
+
+    if opt_compare is not None:
+        with open( opt_compare ) as f:
+            compare( json.load( f ), results )
+
+    return 0
+
+def makeLog( filename, lines, line_length, density, pattern_count ):
+    # the same log is made for the same arguments
+    rand = random.Random( 1 )
+    with open( filename, 'w' ) as f:
+        for line_number in range( lines ):
+            all_words = ['2024-01-01T12:00:%02d' % (line_number % 60,)]
+            if rand.random() < density:
+                all_words.insert( 0 if rand.random() < 0.5 else 1, all_match_words[ rand.randrange( pattern_count ) ] )
+
+            length = sum( len(word) + 1 for word in all_words )
+            while length < line_length:
+                word = rand.choice( all_plain_words )
+                all_words.append( word )
+                length += len(word) + 1
+
+            f.write( ' '.join( all_words ) )
+            f.write( '\n' )
+
+def bestOf( repeat, function ):
+    return min( function() for index in range( repeat ) )
+
+def runLibrary( colour_filter, method, all_patterns, log_filename ):
+    # return the seconds taken to colour log_filename to /dev/null
+    cf = colour_filter.ColourFilter()
+    for pattern, colour in all_patterns:
+        cf.define( pattern, colour )
+
+    with open( log_filename ) as input_file, open( os.devnull, 'w' ) as output_file:
+        start_time = time.perf_counter()
+        if method == 'filterLines':
+            cf.filterLines( input_file, output_file, line_buffered=False )
+
+        else:
+            cf.filterBlocks( input_file, output_file )
+
+        return time.perf_counter() - start_time
+
+def runCli( env, all_patterns, log_filename ):
+    # return the seconds taken and the peak RSS in KiB of colour-filter colouring log_filename
+    cmd = [sys.executable, '-m', 'colour_filter']
+    for pattern, colour in all_patterns:
+        cmd.extend( [pattern, colour] )
+
+    with open( log_filename, 'rb' ) as input_file, open( os.devnull, 'wb' ) as output_file:
+        start_time = time.perf_counter()
+        process = subprocess.Popen( cmd, stdin=input_file, stdout=output_file, env=env )
+        pid, status, rusage = os.wait4( process.pid, 0 )
+        seconds = time.perf_counter() - start_time
+        process.returncode = os.waitstatus_to_exitcode( status )
+
+    if process.returncode != 0:
+        raise RuntimeError( '%s failed with %d' % (' '.join( cmd ), process.returncode) )
+
+    max_rss = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes
+        max_rss //= 1024
+
+    return seconds, max_rss
+
+def startupLatency( env, repeat ):
+    # best time for colour-filter to start, colour no input and exit
+    cmd = [sys.executable, '-m', 'colour_filter', 'ERROR', 'red']
+    all_seconds = []
+    for index in range( max( repeat, 5 ) ):
+        start_time = time.perf_counter()
+        subprocess.run( cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, env=env, check=True )
+        all_seconds.append( time.perf_counter() - start_time )
+
+    return min( all_seconds )
+
+def rates( lines, size, seconds ):
+    return {'seconds': seconds
+           ,'lines_per_second': lines / seconds
+           ,'mb_per_second': size / seconds / 1e6}
+
+def report( name, benchmark ):
+    for method in ('filterLines', 'filterBlocks', 'cli'):
+        if method in benchmark:
+            result = benchmark[ method ]
+            line = '%-15s %-13s %10.0f lines/s %8.2f MB/s' % (name, method, result['lines_per_second'], result['mb_per_second'])
+            if 'peak_rss_kb' in result:
+                line += ' %8d KB peak RSS' % (result['peak_rss_kb'],)
+
+            print( line )
+
+def compare( old_results, new_results, threshold=0.10 ):
+    # print the change in lines/s of each benchmark, slower by more than threshold is a regression
+    print( 'Compared with %s run on %s' % (old_results['colour_filter'], old_results['date']) )
+
+    if 'startup_seconds' in old_results and 'startup_seconds' in new_results:
+        print( '%-29s %+6.1f%%' % ('startup', percentChange( old_results['startup_seconds'], new_results['startup_seconds'] )) )
+
+    for name, new_benchmark in new_results['benchmarks'].items():
+        old_benchmark = old_results['benchmarks'].get( name )
+        if old_benchmark is None:
+            continue
+
+        for method in ('filterLines', 'filterBlocks', 'cli'):
+            if method in old_benchmark and method in new_benchmark:
+                old_rate = old_benchmark[ method ]['lines_per_second']
+                new_rate = new_benchmark[ method ]['lines_per_second']
+                change = percentChange( old_rate, new_rate )
+                note = 'REGRESSION' if new_rate < old_rate * (1 - threshold) else ''
+                print( '%-15s %-13s %+6.1f%% %s' % (name, method, change, note) )
+
+def percentChange( old, new ):
+    return (new - old) / old * 100
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv ) )
@@ -5,3 +5,80 @@ info is yellow info
 error is magenta and info is yellow
 EOF
 
+# no schemes from the user's config
+export XDG_CONFIG_HOME=$(mktemp -d)
+trap 'rm -rf ${XDG_CONFIG_HOME}' EXIT
+
+# the combined regex must colour the same as the per pattern algorithm used by --stats.
+# Patterns that never match are put first so that the runs are long enough to combine
+function compare_with_per_pattern {
+    all_unmatched=( QQ1 red QQ2 green QQ3 blue )
+    for mode in "" "--bytes"
+    do
+        expected=$( ${1} -m colour_filter ${mode} --stats "${all_unmatched[@]}" "${@:2}" <${XDG_CONFIG_HOME}/input 2>/dev/null )
+        actual=$( ${1} -m colour_filter ${mode} "${all_unmatched[@]}" "${@:2}" <${XDG_CONFIG_HOME}/input )
+        if [ "${expected}" != "${actual}" ]
+        then
+            echo "Combined output differs for ${mode} ${*:2}"
+            echo "Expected: ${expected}" | cat -v
+            echo "Actual:   ${actual}" | cat -v
+            exit 1
+        fi
+    done
+}
+
+cat <<EOF >${XDG_CONFIG_HOME}/input
+xa
+abc abcd xabc
+Info: info INFO ERROR error
+word sword words
+ax bx ax
+EOF
+
+# overlapping patterns
+compare_with_per_pattern ${1} ab red b.d green 'c a' blue
+compare_with_per_pattern ${1} 'abcd' red 'bc' green
+# anchors and lookarounds see the end of the uncoloured part of the line
+compare_with_per_pattern ${1} x red '^a' green
+compare_with_per_pattern ${1} 'Info:' red 'info$' green '\binfo\b' blue
+compare_with_per_pattern ${1} s red '\bword' green 'words\B' blue
+compare_with_per_pattern ${1} 'a' red '(?<=a)x' green 'b(?=x)' blue '(?<!a)x' cyan
+# inline flags only apply to their own pattern
+compare_with_per_pattern ${1} '(?i)info' red 'ERROR' green 'error' blue
+compare_with_per_pattern ${1} '(?i)(?s)abc' red 'ERROR' green
+compare_with_per_pattern ${1} 'error' red '(?i)ERROR' green '(?x) a b' blue
+
+# --only-matching-lines and --context write the matching lines and the lines around them
+function check_matching_lines {
+    actual=$( printf 'a\nx\ny\nz\nb\nc\nd\ne\na\n' | ${1} -m colour_filter "${@:3}" '^[ab]' red )
+    if [ "${2}" != "${actual}" ]
+    then
+        echo "Matching lines differ for ${*:3}"
+        echo "Expected: ${2}" | cat -v
+        echo "Actual:   ${actual}" | cat -v
+        exit 1
+    fi
+}
+
+A=$'\e[31;1ma\e[m'
+B=$'\e[31;1mb\e[m'
+for mode in "" "--bytes" "--line-buffered"
+do
+    check_matching_lines ${1} "${A}"$'\n'"${B}"$'\n'"${A}" ${mode} --only-matching-lines
+    check_matching_lines ${1} "${A}"$'\n'"${B}"$'\n'"${A}" ${mode} --context 0
+    check_matching_lines ${1} "${A}"$'\nx\n--\nz\n'"${B}"$'\nc\n--\ne\n'"${A}" ${mode} --context 1
+    check_matching_lines ${1} "${A}"$'\nx\ny\nz\n'"${B}"$'\nc\nd\ne\n'"${A}" ${mode} --context 3
+done
+
+# --follow of commands, a command with no words has a default tag
+${1} -m colour_filter --command '' a red
+T=$'\e[36m[printf]\e[m '
+expected="${T}${A}"$'\n'"${T}${A}"
+actual=$( ${1} -m colour_filter --only-matching-lines --command 'printf "a\nx\na\n"' '^[ab]' red )
+if [ "${expected}" != "${actual}" ]
+then
+    echo "Follow --only-matching-lines differs"
+    echo "Expected: ${expected}" | cat -v
+    echo "Actual:   ${actual}" | cat -v
+    exit 1
+fi
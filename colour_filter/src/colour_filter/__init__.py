@@ -1,7 +1,20 @@
 from __future__ import print_function
 
 import sys
+import os
+import io
+import stat
+import codecs
+import time
 import re
+import collections
+
+try:
+    # python 3.11 and later
+    from re import _parser as sre_parse     # type: ignore
+
+except ImportError:
+    import sre_parse                        # type: ignore
 
 VERSION = '1.1.2'
 
@@ -59,19 +72,963 @@ colour_names = {
 class ColourFilterError(Exception):
     pass
 
+# a leading global inline flag group like (?i) that can
+# be rewritten as a scoped flag group like (?i:...)
+re_global_flags = re.compile( r'^\(\?([ims]+)\)' )
+re_global_flags_bytes = re.compile( rb'^\(\?([ims]+)\)' )
+
+def _sgr( colour, binary ):
+    # the SGR escape sequence for colour, '' for colour gives the end sequence
+    sgr = '\033[%sm' % (colour,)
+    if binary:
+        return sgr.encode( 'ascii' )
+
+    return sgr
+
+def _walkParsed( parsed ):
+    # yield the (op, av) of every node of a parsed regex, including nested nodes
+    for op, av in parsed:
+        yield op, av
+
+        all_items = av if isinstance( av, (tuple, list) ) else (av,)
+        for item in all_items:
+            if isinstance( item, (tuple, list) ):
+                for sub_item in item:
+                    if isinstance( sub_item, sre_parse.SubPattern ):
+                        yield from _walkParsed( sub_item )
+
+            elif isinstance( item, sre_parse.SubPattern ):
+                yield from _walkParsed( item )
+
+def _parsePattern( pattern ):
+    # return the parsed form of the compiled pattern or None if re's parser cannot be used
+    try:
+        return sre_parse.parse( pattern.pattern, pattern.flags )
+
+    except Exception:
+        return None
+
+def _combinableSource( pattern, parsed ):
+    '''
+    return the source of pattern in a form that can be one alternative
+    of a combined regex or None if the pattern cannot be combined
+    '''
+    if parsed is None:
+        return None
+
+    # zero width matches are skipped by the per pattern algorithm,
+    # the combined regex would let them hide the other patterns
+    if parsed.getwidth()[0] == 0:
+        return None
+
+    # group numbers are different in the combined regex
+    for op, av in _walkParsed( parsed ):
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return None
+
+        # the per pattern algorithm searches each uncoloured part of the line
+        # on its own, anchors and lookarounds see the ends of the part there
+        # and the whole line in the combined regex
+        if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            return None
+
+    source = pattern.pattern
+    if isinstance( source, bytes ):
+        default_flags = 0
+        scoped_flags_format = b'(?%s:%s)'
+        global_flags_match = re_global_flags_bytes.match( source )
+
+    else:
+        default_flags = re.UNICODE
+        scoped_flags_format = '(?%s:%s)'
+        global_flags_match = re_global_flags.match( source )
+
+    if pattern.flags == default_flags:
+        return source
+
+    # (?i)(?s)text is turned into (?is:text) so that the flags only apply to this pattern
+    if global_flags_match is None:
+        return None
+
+    all_flags = source[0:0]
+    while global_flags_match is not None:
+        all_flags += global_flags_match.group( 1 )
+        source = source[global_flags_match.end( 0 ):]
+        global_flags_match = global_flags_match.re.match( source )
+
+    source = scoped_flags_format % (all_flags, source)
+
+    # other global flags, like (?x), cannot be scoped
+    try:
+        re.compile( source )
+
+    except re.error:
+        return None
+
+    return source
+
+def _betterLiterals( all_literals_a, all_literals_b ):
+    # the set of literals that will reject the most lines, a set with
+    # longer literals is checked first and then the set with fewer literals
+    if all_literals_a is None:
+        return all_literals_b
+
+    if all_literals_b is None:
+        return all_literals_a
+
+    def score( all_literals ):
+        return (min( len(literal) for literal, ignore_case in all_literals ), -len(all_literals))
+
+    if score( all_literals_b ) > score( all_literals_a ):
+        return all_literals_b
+
+    return all_literals_a
+
+def _requiredLiterals( parsed, ignore_case ):
+    '''
+    return a set of (literal, ignore_case) where literal is a tuple of character codes.
+    Every match of parsed contains at least one of the literals.
+    None is returned if no such set can be found.
+    '''
+    best_literals = None
+    all_run = []
+
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            all_run.append( av )
+            continue
+
+        if len(all_run) > 0:
+            best_literals = _betterLiterals( best_literals, {(tuple( all_run ), ignore_case)} )
+            all_run = []
+
+        if op is sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, sub_parsed = av
+            sub_ignore_case = (ignore_case or bool( add_flags & re.IGNORECASE )) and not del_flags & re.IGNORECASE
+            best_literals = _betterLiterals( best_literals, _requiredLiterals( sub_parsed, sub_ignore_case ) )
+
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr( sre_parse, 'POSSESSIVE_REPEAT', None )):
+            min_repeat, max_repeat, sub_parsed = av
+            if min_repeat >= 1:
+                best_literals = _betterLiterals( best_literals, _requiredLiterals( sub_parsed, ignore_case ) )
+
+        elif op is getattr( sre_parse, 'ATOMIC_GROUP', None ):
+            best_literals = _betterLiterals( best_literals, _requiredLiterals( av, ignore_case ) )
+
+        elif op is sre_parse.BRANCH:
+            # one of the literals of every branch is required
+            all_branch_literals = set()
+            for branch_parsed in av[1]:
+                branch_literals = _requiredLiterals( branch_parsed, ignore_case )
+                if branch_literals is None:
+                    break
+
+                all_branch_literals.update( branch_literals )
+
+            else:
+                best_literals = _betterLiterals( best_literals, all_branch_literals )
+
+        # all other ops, like IN, ANY and AT, are not literals and end the run of literals
+
+    if len(all_run) > 0:
+        best_literals = _betterLiterals( best_literals, {(tuple( all_run ), ignore_case)} )
+
+    return best_literals
+
+def _prefilterRegexes( all_literals, binary ):
+    '''
+    return a list of regexes that between them find any of the literals.
+    The case sensitive and ignore case literals are in different regexes,
+    re cannot use its fast first character scan for a mix of them.
+    '''
+    all_alternatives = []
+    all_ignore_case_alternatives = []
+    for literal, ignore_case in sorted( all_literals ):
+        if binary:
+            literal = re.escape( bytes( literal ) )
+        else:
+            literal = re.escape( ''.join( chr( code ) for code in literal ) )
+
+        if ignore_case:
+            all_ignore_case_alternatives.append( literal )
+        else:
+            all_alternatives.append( literal )
+
+    alternation = b'|' if binary else '|'
+
+    all_regexes = []
+    if len(all_alternatives) > 0:
+        all_regexes.append( re.compile( alternation.join( all_alternatives ) ) )
+
+    if len(all_ignore_case_alternatives) > 0:
+        all_regexes.append( re.compile( alternation.join( all_ignore_case_alternatives ), re.IGNORECASE ) )
+
+    return all_regexes
+
+class _PatternStage:
+    '''
+    colour one pattern by searching each uncoloured part of the line
+    '''
+    def __init__( self, pattern, colour ):
+        self.pattern = pattern
+        self.colour = colour
+
+        binary = isinstance( pattern.pattern, bytes )
+        self.sgr_start = _sgr( colour, binary )
+        self.sgr_end = _sgr( '', binary )
+
+    def apply( self, line_parts ):
+        pattern = self.pattern
+
+        index = 0
+        while index < len(line_parts):
+            coloured, text = line_parts[index]
+
+            if coloured:
+                index += 1
+                continue
+
+            match = pattern.search( text )
+            # no match or match is zero width for patterns like [0-9]*
+            if match is None or match.start(0) == match.end(0):
+                index += 1
+                continue
+
+            pre = text[0:match.start(0)]
+            middle = text[match.start(0):match.end(0)]
+            post = text[match.end(0):]
+
+            if len(pre) > 0:
+                line_parts.insert( index, (False, pre) )
+                index += 1
+
+            line_parts[index] = (True, self.sgr_start + middle + self.sgr_end)
+            index += 1
+
+            if len(post) > 0:
+                line_parts.insert( index, (False, post) )
+
+        return line_parts
+
+def _decodedRead1( input_file ):
+    # return a read1() for the text file input_file that decodes
+    # the bytes available from its buffer like input_file would
+    decoder = codecs.getincrementaldecoder( input_file.encoding )( input_file.errors )
+    decoder = io.IncrementalNewlineDecoder( decoder, translate=True )
+    read1 = input_file.buffer.read1
+
+    def decodedRead1( size ):
+        while True:
+            data = read1( size )
+            text = decoder.decode( data, final=len(data) == 0 )
+            # a read can end part way through a character
+            if len(text) > 0 or len(data) == 0:
+                return text
+
+    return decodedRead1
+
+class _TimedPattern:
+    '''
+    a compiled pattern that records the count and time of its searches in a FilterStats
+    '''
+    def __init__( self, pattern, stats, index ):
+        self.pattern = pattern
+        self.stats = stats
+        self.index = index
+
+    def search( self, text ):
+        start_time = time.perf_counter()
+        match = self.pattern.search( text )
+        self.stats.all_seconds[ self.index ] += time.perf_counter() - start_time
+
+        self.stats.all_searches[ self.index ] += 1
+        if match is not None:
+            if match.start(0) == match.end(0):
+                self.stats.all_zero_width[ self.index ] += 1
+
+            else:
+                self.stats.all_hits[ self.index ] += 1
+
+        return match
+
+class SearchBudget:
+    '''
+    the limits set by ColourFilter.setSearchBudget()
+    '''
+    def __init__( self, max_seconds, max_line_length, max_overruns, warning ):
+        self.max_seconds = max_seconds
+        self.max_line_length = max_line_length
+        self.max_overruns = max_overruns
+        self.warning = warning
+
+    def limits( self ):
+        return (self.max_seconds, self.max_line_length, self.max_overruns)
+
+class _BudgetedPattern:
+    '''
+    a compiled pattern that only searches the first max_line_length
+    characters of the text and that stops searching once its searches have
+    taken longer than max_seconds max_overruns times.
+
+    A search cannot be interrupted, the budget stops one slow pattern
+    slowing down all of the following lines.
+    '''
+    def __init__( self, searcher, pattern, search_budget ):
+        self.searcher = searcher
+        self.pattern = pattern
+        self.search_budget = search_budget
+        self.overruns = 0
+        self.disabled = False
+
+    def search( self, text ):
+        if self.disabled:
+            return None
+
+        budget = self.search_budget
+        if budget.max_line_length is not None and len(text) > budget.max_line_length:
+            text = text[0:budget.max_line_length]
+
+        start_time = time.perf_counter()
+        match = self.searcher.search( text )
+        if time.perf_counter() - start_time > budget.max_seconds:
+            self.overruns += 1
+            if self.overruns >= budget.max_overruns:
+                self.disabled = True
+                budget.warning( 'Pattern %r took longer than %gs %d times and is disabled' %
+                                (self.pattern.pattern, budget.max_seconds, self.overruns) )
+
+        return match
+
+class _CombinedStage:
+    '''
+    colour a run of patterns with one scan of a regex that is the
+    alternation of all the patterns. At each position the first defined
+    pattern that matches wins and the scan continues after the match
+    so that coloured text is never coloured again.
+
+    When a pattern defined earlier matches inside the text that a later
+    pattern matched the earlier pattern must win, those rare lines are
+    coloured by the per pattern algorithm.
+    '''
+    def __init__( self, all_sources, all_patterns ):
+        self.all_sources = all_sources
+        self.all_pattern_stages = [_PatternStage( pattern, colour ) for pattern, colour in all_patterns]
+
+        binary = isinstance( all_sources[0], bytes )
+        self.empty = all_sources[0][0:0]
+        self.sgr_end = _sgr( '', binary )
+
+        all_alternatives = []
+        # map the index of the empty marker group that ends each
+        # pattern's alternative to the pattern's priority and SGR start sequence.
+        # The marker is the last group to close so it is the lastindex
+        # of a match. Wrapping the whole pattern in a capture group instead
+        # stops re from using its fast first character scan.
+        self.all_markers = {}
+
+        group_index = 0
+        for priority, (source, (pattern, colour)) in enumerate( zip( all_sources, all_patterns ) ):
+            if binary:
+                all_alternatives.append( b'(?:%s)()' % (source,) )
+            else:
+                all_alternatives.append( '(?:%s)()' % (source,) )
+
+            group_index += pattern.groups + 1
+            self.all_markers[ group_index ] = (priority, _sgr( colour, binary ))
+
+        if binary:
+            self.regex = re.compile( b'|'.join( all_alternatives ) )
+        else:
+            self.regex = re.compile( '|'.join( all_alternatives ) )
+
+    def matchSpans( self, text ):
+        '''
+        return the list of (start, end, sgr_start) of the text to colour or
+        None when a higher priority pattern matches inside a match.
+
+        At any position the alternation matches the highest priority pattern
+        that can match there, so only the first match at each position inside
+        a match needs to be checked. The first match found at or after the end
+        of a match is the next match as the combined patterns do not look
+        behind their start.
+        '''
+        search = self.regex.search
+        all_markers = self.all_markers
+
+        all_spans = []
+        match = search( text )
+        while match is not None:
+            start, end = match.span()
+            priority, sgr_start = all_markers[ match.lastindex ]
+            all_spans.append( (start, end, sgr_start) )
+
+            if priority == 0:
+                match = search( text, end )
+                continue
+
+            match = search( text, start + 1 )
+            while match is not None and match.start() < end:
+                if all_markers[ match.lastindex ][0] < priority:
+                    return None
+
+                match = search( text, match.start() + 1 )
+
+        return all_spans
+
+    def applyPerPattern( self, line_parts ):
+        for stage in self.all_pattern_stages:
+            line_parts = stage.apply( line_parts )
+
+        return line_parts
+
+    def colourText( self, text ):
+        # returns text itself when there is nothing to colour
+        all_spans = self.matchSpans( text )
+        if all_spans is None:
+            return self.empty.join( [part for coloured, part in self.applyPerPattern( [(False, text)] )] )
+
+        if len(all_spans) == 0:
+            return text
+
+        sgr_end = self.sgr_end
+        all_text_parts = []
+        index = 0
+        for start, end, sgr_start in all_spans:
+            all_text_parts.append( text[index:start] )
+            all_text_parts.append( sgr_start )
+            all_text_parts.append( text[start:end] )
+            all_text_parts.append( sgr_end )
+            index = end
+
+        all_text_parts.append( text[index:] )
+        return self.empty.join( all_text_parts )
+
+    def apply( self, line_parts ):
+        sgr_end = self.sgr_end
+
+        all_new_parts = []
+        for coloured, text in line_parts:
+            if coloured:
+                all_new_parts.append( (coloured, text) )
+                continue
+
+            all_spans = self.matchSpans( text )
+            if all_spans is None:
+                all_new_parts.extend( self.applyPerPattern( [(False, text)] ) )
+                continue
+
+            index = 0
+            for start, end, sgr_start in all_spans:
+                if start > index:
+                    all_new_parts.append( (False, text[index:start]) )
+
+                all_new_parts.append( (True, sgr_start + text[start:end] + sgr_end) )
+                index = end
+
+            if index < len(text):
+                all_new_parts.append( (False, text[index:]) )
+
+        return all_new_parts
+
+# filterMapped() uses filterBlocks() when more than this fraction of the
+# lines in the first mapped_sample_size bytes of a file need colouring
+max_mapped_candidate_fraction = 0.5
+mapped_sample_size = 64*1024
+
+# a line including its newline, used to split a block into lines
+# in one call. The line endings are the same as readline() returns
+re_line = re.compile( r'[^\n]*\n' )
+re_line_bytes = re.compile( rb'[^\n]*\n' )
+
+# the fewest patterns in a run that are combined. The alternation loses
+# the fast literal search of each pattern so on long lines a few patterns
+# are quicker to search for one at a time
+min_combined_patterns = 4
+
+def _planEngine( all_patterns, binary, debug ):
+    '''
+    work out how to colour all_patterns and return the plan as a dict that
+    marshal can save. The plan has:
+
+    stages      - list of ('combined', indexes, sources) or ('pattern', index)
+                  where index is the index of a pattern in all_patterns
+    prefilters  - list of (source, flags) of the prefilter regexes
+    '''
+    all_stages = []
+
+    all_run_sources = []
+    all_run_indexes = []
+    all_run_group_names = set()
+
+    # None after a pattern without literals is found
+    all_prefilter_literals = set()
+
+    def flushRun():
+        if len(all_run_indexes) >= min_combined_patterns:
+            debug( 'Combined %d patterns into one regex' % (len(all_run_indexes),) )
+            all_stages.append( ('combined', tuple( all_run_indexes ), tuple( all_run_sources )) )
+
+        else:
+            if len(all_run_indexes) > 1:
+                debug( 'Run of %d patterns is too short to combine' % (len(all_run_indexes),) )
+
+            for index in all_run_indexes:
+                all_stages.append( ('pattern', index) )
+
+        del all_run_sources[:]
+        del all_run_indexes[:]
+        all_run_group_names.clear()
+
+    for index, (pattern, colour) in enumerate( all_patterns ):
+        parsed = _parsePattern( pattern )
+
+        if all_prefilter_literals is not None:
+            all_literals = None
+            if parsed is not None and not pattern.flags & re.LOCALE:
+                all_literals = _requiredLiterals( parsed, bool( pattern.flags & re.IGNORECASE ) )
+
+            if all_literals is None:
+                debug( 'Pattern %r has no literal text, all lines are matched against the patterns' % (pattern.pattern,) )
+                all_prefilter_literals = None
+
+            else:
+                all_prefilter_literals.update( all_literals )
+
+        source = _combinableSource( pattern, parsed )
+        if source is None:
+            flushRun()
+            debug( 'Pattern %r cannot be combined' % (pattern.pattern,) )
+            all_stages.append( ('pattern', index) )
+            continue
+
+        # group names must be unique in the combined regex
+        if not all_run_group_names.isdisjoint( pattern.groupindex ):
+            flushRun()
+
+        all_run_sources.append( source )
+        all_run_indexes.append( index )
+        all_run_group_names.update( pattern.groupindex )
+
+    flushRun()
+
+    all_prefilters = []
+    if all_prefilter_literals:
+        for prefilter in _prefilterRegexes( all_prefilter_literals, binary ):
+            debug( 'Prefilter %r' % (prefilter.pattern,) )
+            all_prefilters.append( (prefilter.pattern, prefilter.flags) )
+
+    return {'stages': all_stages, 'prefilters': all_prefilters}
+
+class _FilterEngine:
+    '''
+    the compiled form of a ColourFilter's patterns built from the plan
+    made by _planEngine().
+
+    Runs of at least min_combined_patterns patterns that can be combined are
+    coloured by one _CombinedStage. Shorter runs and the patterns that cannot be
+    combined, those with backreferences, anchors, lookarounds, flags that cannot
+    be scoped or that can match zero width, are coloured by a _PatternStage
+    using the original per pattern algorithm.
+
+    When every pattern has literal text that all its matches contain the
+    engine has a prefilter, regexes of all the literals. Only lines that contain
+    one of the literals are passed to the stages.
+    '''
+    def __init__( self, all_patterns, binary, plan, stats=None, search_budget=None, line_cache=None ):
+        self.plan = plan
+
+        if binary:
+            self.empty = b''
+            self.newline = b'\n'
+            self.findLines = re_line_bytes.findall
+
+        else:
+            self.empty = ''
+            self.newline = '\n'
+            self.findLines = re_line.findall
+
+        self.all_stages = []
+        for stage in plan['stages']:
+            if stage[0] == 'combined':
+                kind, all_indexes, all_sources = stage
+                try:
+                    self.all_stages.append( _CombinedStage( list( all_sources ), [all_patterns[index] for index in all_indexes] ) )
+                    continue
+
+                except re.error:
+                    # colour the patterns one at a time
+                    pass
+
+            else:
+                kind, index = stage
+                all_indexes = [index]
+
+            for index in all_indexes:
+                self.all_stages.append( _PatternStage( *all_patterns[index] ) )
+                if stats is not None:
+                    self.all_stages[-1].pattern = _TimedPattern( self.all_stages[-1].pattern, stats, index )
+
+                if search_budget is not None:
+                    self.all_stages[-1].pattern = _BudgetedPattern( self.all_stages[-1].pattern, all_patterns[index][0], search_budget )
+
+        if len(self.all_stages) == 1 and isinstance( self.all_stages[0], _CombinedStage ):
+            # the common case needs no list of line parts
+            self.colourCandidateLine = self.all_stages[0].colourText
+
+        if line_cache is not None:
+            line_cache.colourLine = self.colourCandidateLine
+            self.colourCandidateLine = line_cache.colourCachedLine
+
+        if stats is not None:
+            colourCandidateLine = self.colourCandidateLine
+
+            def countedColourCandidateLine( line ):
+                stats.lines += 1
+                stats.size += len(line)
+                return colourCandidateLine( line )
+
+            self.colourCandidateLine = countedColourCandidateLine
+
+        self.all_prefilters = [re.compile( source, flags ) for source, flags in plan['prefilters']]
+        if len(self.all_prefilters) == 0:
+            self.colourLine = self.colourCandidateLine
+
+        # regexes that find the lines writeMapped() must colour, a line
+        # that a combined regex finds nothing in is not changed by it
+        self.all_line_finders = self.all_prefilters
+        if len(self.all_line_finders) == 0 and all( isinstance( stage, _CombinedStage ) for stage in self.all_stages ):
+            self.all_line_finders = [stage.regex for stage in self.all_stages]
+
+    def colourLine( self, line ):
+        # returns line itself when there is nothing to colour
+        for prefilter in self.all_prefilters:
+            if prefilter.search( line ) is not None:
+                return self.colourCandidateLine( line )
+
+        return line
+
+    def colourBlock( self, block, end_of_lines ):
+        # return the coloured form of the lines in block[0:end_of_lines],
+        # block[end_of_lines-1] must be a newline
+        if len(self.all_stages) == 0:
+            return block[0:end_of_lines]
+
+        colourCandidateLine = self.colourCandidateLine
+
+        if len(self.all_prefilters) == 0:
+            return self.empty.join( [colourCandidateLine( line ) for line in self.findLines( block, 0, end_of_lines )] )
+
+        # scan the whole block for the literals, only the lines with a literal
+        # are coloured and the text between them is output as it is
+        newline = self.newline
+
+        all_line_starts = self.candidateLineStarts( block, 0, end_of_lines )
+        if len(all_line_starts) == 0:
+            return block[0:end_of_lines]
+
+        all_parts = []
+        index = 0
+        for line_start in all_line_starts:
+            line_end = block.find( newline, line_start, end_of_lines ) + 1
+
+            all_parts.append( block[index:line_start] )
+            all_parts.append( colourCandidateLine( block[line_start:line_end] ) )
+            index = line_end
+
+        all_parts.append( block[index:end_of_lines] )
+        return self.empty.join( all_parts )
+
+    def candidateLineStarts( self, block, start, end, all_finders=None ):
+        # return the sorted offsets of the lines in block[start:end] that
+        # contain a literal of the prefilters, or a match of all_finders,
+        # block[end-1] must be a newline
+        newline = self.newline
+        if all_finders is None:
+            all_finders = self.all_prefilters
+
+        all_line_starts = set()
+        for prefilter in all_finders:
+            search = prefilter.search
+            index = start
+            while True:
+                hit = search( block, index, end )
+                if hit is None:
+                    break
+
+                hit_start = hit.start()
+                all_line_starts.add( max( block.rfind( newline, 0, hit_start ) + 1, start ) )
+                # carry on from the next line
+                index = block.find( newline, hit_start, end ) + 1
+
+        return sorted( all_line_starts )
+
+    def candidateFraction( self, block ):
+        # return the fraction of the whole lines in block that writeMapped() copies
+        end_of_lines = block.rfind( self.newline ) + 1
+        lines = block.count( self.newline, 0, end_of_lines )
+        if lines == 0 or len(self.all_stages) == 0:
+            return 0.0
+
+        if len(self.all_line_finders) == 0:
+            return 1.0
+
+        return len( self.candidateLineStarts( block, 0, end_of_lines, self.all_line_finders ) ) / lines
+
+    def writeMapped( self, mapped, start, output_file, window_size=64*1024 ):
+        # write the coloured form of mapped[start:] to output_file.
+        # mapped is a bytes like object, usually an mmap, that supports find()
+        # and rfind(). Only the lines that are coloured are copied, the text
+        # between them is written from a memoryview of mapped.
+        # When the patterns can only be checked one line at a time every line is copied
+        newline = self.newline
+        colourCandidateLine = self.colourCandidateLine
+        end_of_lines = max( mapped.rfind( newline, start ) + 1, start )
+
+        with memoryview( mapped ) as view:
+            if len(self.all_stages) == 0:
+                output_file.write( view[start:] )
+                return
+
+            while start < end_of_lines:
+                # a window of whole lines
+                end = mapped.find( newline, min( start + window_size, end_of_lines ) - 1 ) + 1
+
+                if len(self.all_line_finders) == 0:
+                    output_file.write( self.empty.join( [colourCandidateLine( line ) for line in self.findLines( mapped, start, end )] ) )
+
+                else:
+                    all_parts = []
+                    index = start
+                    for line_start in self.candidateLineStarts( mapped, start, end, self.all_line_finders ):
+                        line_end = mapped.find( newline, line_start, end ) + 1
+
+                        if line_start > index:
+                            all_parts.append( view[index:line_start] )
+
+                        all_parts.append( colourCandidateLine( mapped[line_start:line_end] ) )
+                        index = line_end
+
+                    if end > index:
+                        all_parts.append( view[index:end] )
+
+                    # the views are written without being joined into a copy
+                    output_file.writelines( all_parts )
+
+                start = end
+
+        if end_of_lines < len(mapped):
+            output_file.write( self.colourLine( mapped[end_of_lines:] ) )
+
+    def colourText( self, text ):
+        # return the coloured form of text that has any number of lines
+        end_of_lines = text.rfind( self.newline ) + 1
+        coloured_text = self.colourBlock( text, end_of_lines )
+        if end_of_lines < len(text):
+            coloured_text += self.colourLine( text[end_of_lines:] )
+
+        return coloured_text
+
+    def colourMatchingLine( self, line ):
+        # return the coloured line or empty if no pattern matched it
+        coloured_line = self.colourLine( line )
+        if len(coloured_line) == len(line):
+            return self.empty
+
+        return coloured_line
+
+    def colourMatchingBlock( self, block, end_of_lines ):
+        # like colourBlock() but only the lines that a pattern matched are returned
+        colourCandidateLine = self.colourCandidateLine
+
+        if len(self.all_prefilters) == 0:
+            all_lines = self.findLines( block, 0, end_of_lines )
+
+        else:
+            newline = self.newline
+            all_lines = [block[line_start:block.find( newline, line_start, end_of_lines ) + 1]
+                            for line_start in self.candidateLineStarts( block, 0, end_of_lines )]
+
+        all_coloured_lines = []
+        for line in all_lines:
+            coloured_line = colourCandidateLine( line )
+            if len(coloured_line) != len(line):
+                all_coloured_lines.append( coloured_line )
+
+        return self.empty.join( all_coloured_lines )
+
+    def colourCandidateLine( self, line ):
+        # list of tuples of (coloured, text)
+        # only colour in text that is not already coloured
+        line_parts = [(False, line)]
+
+        for stage in self.all_stages:
+            line_parts = stage.apply( line_parts )
+
+        if len(line_parts) == 1 and not line_parts[0][0]:
+            return line
+
+        return self.empty.join( [text for coloured, text in line_parts] )
+
+class LineCache:
+    '''
+    a least recently used cache of coloured lines keyed by the input line.
+    Holds at most max_lines lines whose total size of input and coloured
+    text is at most max_size.
+    '''
+    def __init__( self, max_lines, max_size ):
+        self.max_lines = max_lines
+        self.max_size = max_size
+
+        # set by the _FilterEngine to colour lines that are not cached
+        self.colourLine = None
+
+        self.all_lines = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def colourCachedLine( self, line ):
+        coloured_line = self.all_lines.get( line )
+        if coloured_line is not None:
+            self.hits += 1
+            self.all_lines.move_to_end( line )
+            return coloured_line
+
+        self.misses += 1
+        coloured_line = self.colourLine( line )
+
+        size = len(line) + len(coloured_line)
+        if size > self.max_size:
+            return coloured_line
+
+        self.all_lines[ line ] = coloured_line
+        self.size += size
+
+        # forget the least recently used lines
+        while len(self.all_lines) > self.max_lines or self.size > self.max_size:
+            old_line, old_coloured_line = self.all_lines.popitem( last=False )
+            self.size -= len(old_line) + len(old_coloured_line)
+
+        return coloured_line
+
+class FilterStats:
+    '''
+    the number of searches, hits and zero width matches and the time spent
+    searching for each pattern of a ColourFilter, indexed like all_patterns.
+    Collected when ColourFilter.enableStats() is used.
+    '''
+    def __init__( self, all_patterns, binary ):
+        self.all_patterns = all_patterns
+        self.binary = binary
+
+        self.all_searches = [0] * len(all_patterns)
+        self.all_hits = [0] * len(all_patterns)
+        self.all_zero_width = [0] * len(all_patterns)
+        self.all_seconds = [0.0] * len(all_patterns)
+
+        # lines and the total size of the lines matched
+        self.lines = 0
+        self.size = 0
+        self.start_time = time.perf_counter()
+
+    def report( self ):
+        # return the stats as a table of text
+        elapsed = max( time.perf_counter() - self.start_time, 1e-9 )
+        unit = 'bytes' if self.binary else 'chars'
+
+        all_lines = []
+        all_lines.append( '%d lines and %d %s in %.3fs, %.0f lines/sec %.0f %s/sec' %
+                            (self.lines, self.size, unit, elapsed
+                            ,self.lines / elapsed, self.size / elapsed, unit) )
+        all_lines.append( '%10s %10s %10s %10s  %s' % ('searches', 'hits', 'zero-width', 'seconds', 'pattern') )
+        for index, (pattern, colour) in enumerate( self.all_patterns ):
+            all_lines.append( '%10d %10d %10d %10.3f  %r' %
+                            (self.all_searches[ index ], self.all_hits[ index ], self.all_zero_width[ index ]
+                            ,self.all_seconds[ index ], pattern.pattern) )
+
+        return '\n'.join( all_lines ) + '\n'
+
 class ColourFilter:
     '''
     ColourFilter - colour parts of input lines matching regex patterns
+
+    When binary is True the patterns are compiled as bytes and the
+    input and output files must be binary files. Lines are never decoded.
     '''
-    def __init__( self ):
+    def __init__( self, binary=False ):
         self.opt_debug = False
+        self.opt_stats = False
+        self.binary = binary
 
         self.all_patterns = []
+        # made from all_patterns when first needed
+        self._plan = None
+        self._engine = None
+        self._stats = None
+        self._search_budget = None
+        self._line_cache_limits = None
+        self._line_cache = None
 
     def enableDebug( self, enable=True ):
         self.opt_debug = enable
 
+    def enableStats( self, enable=True ):
+        # record the searches of each pattern, see stats().
+        # the patterns are searched for one at a time so that each can be timed
+        self.opt_stats = enable
+        self._engine = None
+
+    def stats( self ):
+        # return the FilterStats of the patterns or None if stats are not enabled
+        self.engine()
+        return self._stats
+
+    def setSearchBudget( self, max_seconds, max_line_length=None, max_overruns=3 ):
+        '''
+        protect against patterns that take too long to search.
+        Only the first max_line_length characters of a line are searched.
+        A pattern that takes longer than max_seconds for a search max_overruns
+        times is disabled and a warning naming it is printed.
+        Use max_seconds=None to turn off the budget.
+        '''
+        if max_line_length is not None and max_line_length < 1:
+            raise ColourFilterError( 'Search budget needs a max_line_length of at least 1' )
+
+        if max_seconds is None:
+            self._search_budget = None
+
+        else:
+            self._search_budget = SearchBudget( max_seconds, max_line_length, max_overruns, self.warning )
+
+        self._engine = None
+
+    def enableLineCache( self, max_lines=10000, max_size=4*1024*1024, enable=True ):
+        # remember the coloured form of the most recently seen lines so that
+        # repeated lines are not matched again, see lineCache()
+        if enable:
+            if max_lines < 1 or max_size < 1:
+                raise ColourFilterError( 'Line cache needs max_lines and max_size of at least 1' )
+
+            self._line_cache_limits = (max_lines, max_size)
+
+        else:
+            self._line_cache_limits = None
+
+        self._engine = None
+
+    def lineCache( self ):
+        # return the LineCache, with its hits and misses, or None if not enabled
+        self.engine()
+        return self._line_cache
+
     def define( self, pattern, colour ):
+        if self.binary and isinstance( pattern, str ):
+            # surrogateescape gives back the original bytes of a command line argument
+            pattern = pattern.encode( 'utf-8', 'surrogateescape' )
+
+        elif not self.binary and isinstance( pattern, bytes ):
+            pattern = pattern.decode( 'utf-8' )
+
         try:
             pattern = re.compile( pattern )
 
@@ -90,55 +1047,326 @@ class ColourFilter:
             raise ColourFilterError( 'Unknown colour %s' % (str(e),) )
 
         self.all_patterns.append( (pattern, ';'.join(all_colour_parts)) )
+        self._plan = None
+        self._engine = None
 
     def patternList( self ):
         return [(re_pattern.pattern, colour) for re_pattern, colour in self.all_patterns]
 
+    def compiledForm( self ):
+        '''
+        return the patterns with their SGR codes and the plan of the engine
+        as a dict that can be saved with marshal and passed to defineCompiled()
+        '''
+        return {'binary': self.binary
+               ,'patterns': self.patternList()
+               ,'plan': self.plan()}
+
+    def defineCompiled( self, compiled_form ):
+        # define the patterns from compiledForm() without checking the colours
+        # or analysing the patterns again
+        if compiled_form['binary'] != self.binary:
+            raise ColourFilterError( 'Compiled patterns are for binary=%r' % (compiled_form['binary'],) )
+
+        # the plan is only correct if these are the only patterns
+        use_plan = len(self.all_patterns) == 0
+
+        for source, colour in compiled_form['patterns']:
+            self.all_patterns.append( (re.compile( source ), colour) )
+
+        if use_plan:
+            self._plan = compiled_form['plan']
+
+        else:
+            self._plan = None
+
+        self._engine = None
+
+    def plan( self ):
+        if self._plan is None:
+            self._plan = _planEngine( self.all_patterns, self.binary, self.debug )
+
+        return self._plan
+
+    def engine( self ):
+        if self._engine is not None:
+            return self._engine
+
+        plan = self.plan()
+        self._stats = None
+
+        if self.opt_stats or self._search_budget is not None:
+            # each pattern is searched for on its own so that it can be timed
+            all_stages = [('pattern', index) for index in range( len(self.all_patterns) )]
+            if self.opt_stats:
+                # count every search
+                plan = {'stages': all_stages, 'prefilters': []}
+                self._stats = FilterStats( self.all_patterns, self.binary )
+
+            else:
+                plan = {'stages': all_stages, 'prefilters': plan['prefilters']}
+
+        self._line_cache = None
+        if self._line_cache_limits is not None:
+            self._line_cache = LineCache( *self._line_cache_limits )
+
+        self._engine = _FilterEngine( self.all_patterns, self.binary, plan, self._stats, self._search_budget, self._line_cache )
+        return self._engine
+
+    def filterIter( self, all_lines ):
+        # yield the coloured form of each line of the iterable all_lines
+        colourLine = self.engine().colourLine
+        for line in all_lines:
+            yield colourLine( line )
+
+    def filterText( self, text ):
+        # return the coloured form of text that has any number of lines
+        return self.engine().colourText( text )
+
+    def filterBatch( self, all_lines ):
+        # return a list of the coloured form of each line of all_lines
+        colourLine = self.engine().colourLine
+        return [colourLine( line ) for line in all_lines]
+
     def filterLines( self, input_file, output_file, line_buffered ):
+        colourLine = self.engine().colourLine
+
         while True:
             line = input_file.readline()
-            if line == '':
+            if len(line) == 0:
                 break
 
-            # list of tuples of (coloured, text)
-            # only colour in text that is not already coloured
-            line_parts = [(False, line)]
+            output_file.write( colourLine( line ) )
+            if line_buffered:
+                output_file.flush()
 
-            for pattern, colour in self.all_patterns:
-                index = 0
+    def filterBlocks( self, input_file, output_file, block_size=64*1024 ):
+        # read input in blocks of block_size and write each block's coloured lines in one write.
+        # read1() is used if the input_file has it so that lines are output as soon as
+        # a block of them is available
+        engine = self.engine()
+        self._filterBlocks( input_file, output_file, block_size, engine.colourBlock, engine.colourLine )
 
-                while index < len(line_parts):
-                    coloured, text = line_parts[index]
+    def filterMatchingLines( self, input_file, output_file, context=0, line_buffered=False ):
+        '''
+        write only the lines that a pattern matched, coloured, and the context
+        lines before and after them. Groups of lines that are not next to
+        each other are separated by a -- line.
+        '''
+        engine = self.engine()
+        if context == 0 and not line_buffered:
+            self._filterBlocks( input_file, output_file, 64*1024, engine.colourMatchingBlock, engine.colourMatchingLine )
+            return
 
-                    if coloured:
-                        index += 1
-                        continue
+        colourLine = engine.colourLine
+        separator = b'--\n' if self.binary else '--\n'
 
-                    match = pattern.search( text )
-                    # no match or match is zero width for patterns like [0-9]*
-                    if match is None or match.start(0) == match.end(0):
-                        index += 1
-                        continue
+        all_before_lines = collections.deque( maxlen=context )
+        after_lines = 0
+        # line number of the last line written
+        last_written = None
 
-                    pre = text[0:match.start(0)]
-                    middle = text[match.start(0):match.end(0)]
-                    post = text[match.end(0):]
+        line_number = 0
+        while True:
+            line = input_file.readline()
+            if len(line) == 0:
+                break
+
+            line_number += 1
+            coloured_line = colourLine( line )
+
+            # colouring always makes a line longer
+            if len(coloured_line) != len(line):
+                if context > 0 and last_written is not None and line_number - len(all_before_lines) > last_written + 1:
+                    output_file.write( separator )
 
-                    if len(pre) > 0:
-                        line_parts.insert( index, (False, pre) )
-                        index += 1
+                for before_line in all_before_lines:
+                    output_file.write( before_line )
 
-                    line_parts[index] = (True, '\033[%sm%s\033[m' % (colour, middle))
-                    index += 1
+                all_before_lines.clear()
+                output_file.write( coloured_line )
+                last_written = line_number
+                after_lines = context
 
-                    if len(post) > 0:
-                        line_parts.insert( index, (False, post) )
+            elif after_lines > 0:
+                output_file.write( line )
+                last_written = line_number
+                after_lines -= 1
+
+            else:
+                all_before_lines.append( line )
+                continue
 
-            output_file.write( ''.join( [text for coloured, text in line_parts] ) )
             if line_buffered:
                 output_file.flush()
 
+        output_file.flush()
+
+    def _filterBlocks( self, input_file, output_file, block_size, colourBlock, colourLine ):
+        engine = self.engine()
+        empty = engine.empty
+        read = getattr( input_file, 'read1', None )
+        if read is None and not self.binary and hasattr( getattr( input_file, 'buffer', None ), 'read1' ):
+            # a text file's read() waits for block_size characters, decode
+            # what its binary buffer has so that lines are not held back
+            read = _decodedRead1( input_file )
+
+        if read is None:
+            read = input_file.read
+
+        # the parts of the last line of the input read so far that has no newline yet
+        all_partial_parts = []
+        while True:
+            block = read( block_size )
+            if len(block) == 0:
+                break
+
+            end_of_lines = block.rfind( engine.newline ) + 1
+            if end_of_lines == 0:
+                all_partial_parts.append( block )
+                continue
+
+            if len(all_partial_parts) > 0:
+                end_of_lines += sum( len(part) for part in all_partial_parts )
+                all_partial_parts.append( block )
+                block = empty.join( all_partial_parts )
+                all_partial_parts = []
+
+            if end_of_lines < len(block):
+                all_partial_parts.append( block[end_of_lines:] )
+
+            output_file.write( colourBlock( block, end_of_lines ) )
+
+        if len(all_partial_parts) > 0:
+            output_file.write( colourLine( empty.join( all_partial_parts ) ) )
+
+        output_file.flush()
+
+    def filterMapped( self, input_file, output_file ):
+        # colour input_file, a binary file, from its current position by mapping
+        # it into memory. Only the coloured lines are copied, the rest of the file
+        # is written to output_file straight from the mapping.
+        # Files that cannot be mapped, pipes, ttys and empty files, and files
+        # where most lines need colouring are coloured by filterBlocks()
+        if not self.binary:
+            raise ColourFilterError( 'filterMapped needs a binary ColourFilter' )
+
+        try:
+            fd = input_file.fileno()
+            st = os.fstat( fd )
+
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            st = None
+
+        if st is None or not stat.S_ISREG( st.st_mode ) or st.st_size == 0:
+            self.filterBlocks( input_file, output_file )
+            return
+
+        # only the --bytes mode of colour-filter needs mmap
+        import mmap
+
+        start = input_file.tell()
+        engine = self.engine()
+        with mmap.mmap( fd, 0, access=mmap.ACCESS_READ ) as mapped:
+            # judge the file by its first block
+            use_mapped = engine.candidateFraction( mapped[start:start + mapped_sample_size] ) <= max_mapped_candidate_fraction
+            if use_mapped:
+                engine.writeMapped( mapped, start, output_file )
+                input_file.seek( len(mapped) )
+
+        if not use_mapped:
+            # copying most of the lines gains nothing over reading them in blocks
+            self.filterBlocks( input_file, output_file )
+            return
+
+        output_file.flush()
+
+    def filterFile( self, filename, output_file, processes=None, chunk_size=4*1024*1024 ):
+        # colour the file filename using a pool of processes that each colour
+        # a chunk of the file that ends at a line boundary. The output is written
+        # in the order of the file. Small files, and all files when stats are
+        # enabled, are coloured by this process.
+        if processes is None:
+            if hasattr( os, 'sched_getaffinity' ):
+                processes = len( os.sched_getaffinity( 0 ) )
+            else:
+                processes = os.cpu_count() or 1
+
+        if processes <= 1 or self.opt_stats or os.path.getsize( filename ) < 2*chunk_size:
+            if self.binary:
+                with open( filename, 'rb' ) as input_file:
+                    self.filterMapped( input_file, output_file )
+
+            else:
+                with open( filename, 'r' ) as input_file:
+                    self.filterBlocks( input_file, output_file )
+
+            return
+
+        import multiprocessing
+
+        search_budget_limits = None
+        if self._search_budget is not None:
+            search_budget_limits = self._search_budget.limits()
+
+        all_init_args = (self.compiledForm(), search_budget_limits, self._line_cache_limits)
+        with multiprocessing.Pool( processes, _initFilterFileWorker, all_init_args ) as pool:
+            all_pending = collections.deque()
+            for start, end in _fileChunks( filename, chunk_size ):
+                all_pending.append( pool.apply_async( _filterFileChunk, (filename, start, end) ) )
+
+                # only keep a few chunks per process waiting to be written
+                if len(all_pending) > 2*processes:
+                    output_file.write( all_pending.popleft().get() )
+
+            while len(all_pending) > 0:
+                output_file.write( all_pending.popleft().get() )
+
+        output_file.flush()
+
     def debug( self, msg ):
         if self.opt_debug:
             print( 'Debug: %s' % (msg,) )
             sys.stdout.flush()
+
+    def warning( self, msg ):
+        # warnings go to stderr so that they are not mixed into the filtered output
+        print( 'Warning: %s' % (msg,), file=sys.stderr )
+        sys.stderr.flush()
+
+def _fileChunks( filename, chunk_size ):
+    # yield the (start, end) offsets of chunks of filename that end at a line boundary
+    size = os.path.getsize( filename )
+    with open( filename, 'rb' ) as f:
+        start = 0
+        while start < size:
+            f.seek( start + chunk_size )
+            f.readline()
+            end = min( f.tell(), size )
+
+            yield start, end
+            start = end
+
+# the ColourFilter of a filterFile() worker process
+_worker_filter = None
+
+def _initFilterFileWorker( compiled_form, search_budget_limits, line_cache_limits ):
+    global _worker_filter
+    _worker_filter = ColourFilter( binary=compiled_form['binary'] )
+    _worker_filter.defineCompiled( compiled_form )
+    if search_budget_limits is not None:
+        _worker_filter.setSearchBudget( *search_budget_limits )
+
+    if line_cache_limits is not None:
+        _worker_filter.enableLineCache( *line_cache_limits )
+
+def _filterFileChunk( filename, start, end ):
+    with open( filename, 'rb' ) as f:
+        f.seek( start )
+        chunk = f.read( end - start )
+
+    if not _worker_filter.binary:
+        # decode and translate newlines the same way as open( filename, 'r' )
+        chunk = io.TextIOWrapper( io.BytesIO( chunk ) ).read()
+
+    return _worker_filter.engine().colourText( chunk )
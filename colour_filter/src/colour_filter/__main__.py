@@ -4,19 +4,27 @@ from __future__ import print_function
 
 import sys
 import os
+import marshal
 import colour_filter
 import colour_text
-import json
 from config_path import ConfigPath  # type: ignore
 
+# change when the layout of the scheme cache changes
+scheme_cache_format = 3
+
 def usage( ct, cfg_filename ):
-    print( ct('''Usage: colour-filter <options> [<>em pattern<> <>em colour<>]*
+    print( ct('''Usage: colour-filter <options> [<>em pattern<> <>em colour<>]* [-- <>em file<>...]
+       colour-filter <options> -s <>em scheme<> [<>em file<>...]
 
-Read lines from stdin and print them colour based on the <>em pattern<> <>em colour<> pairs.
+Read lines from stdin, or the <>em file<> arguments, and print them colour
+based on the <>em pattern<> <>em colour<> pairs.
 
 The <>em pattern<> <>em colour<> pairs can be supplied on the command line or taken from a
 pre-defined scheme.
 
+Large files are split into chunks that are coloured in parallel
+using all the CPUs. The output is in the same order as the file.
+
 Scheme definitions are stored in %s.
 
 Options:
@@ -28,19 +36,161 @@ Options:
     -d, --delete               - Delete the <>em scheme<>
     -l,--list-schemes          - List all the schemes that have been
                                  defined.
+    --line-buffered            - Output each line as soon as it is read.
+                                 This is the default when the output
+                                 is a terminal, otherwise lines are read
+                                 and written in large blocks.
+    --search-budget <>em seconds<>   - Disable any pattern that takes longer
+                                 than <>em seconds<> to search a line 3 times.
+    --max-line-length <>em length<>  - Only search the first <>em length<> characters
+                                 of each line. Implies a --search-budget of 0.1s.
+    --line-cache <>em lines<>        - Remember the coloured form of the last <>em lines<>
+                                 different lines so that repeated lines are
+                                 only matched once.
+    --only-matching-lines      - Only output the lines that a pattern matched.
+    --context <>em lines<>           - Also output <>em lines<> lines before and after
+                                 each matching line. Implies --only-matching-lines.
+    -f, --follow               - Follow the <>em file<> arguments, like tail -f,
+                                 and the output of the --command options.
+                                 Each line is prefixed with a coloured tag
+                                 of its source.
+    --command <>em command<>         - Follow the output of <>em command<>.
+                                 Can be used more than once. Implies --follow.
+                                 --context cannot be used with --follow.
+    --stats                    - Print the number of searches, hits and time
+                                 taken by each pattern to stderr on exit
+                                 and when sent SIGUSR1.
+    --bytes                    - Match the patterns against the bytes of
+                                 the input without decoding it. Input that
+                                 is not valid UTF-8 is passed through unchanged.
 ''') % (cfg_filename,) )
 
+def loadConfig( config_file ):
+    if config_file is None:
+        return {}
+
+    # json is only imported when the scheme cache is rebuilt or a scheme is changed
+    import json
+
+    with open( config_file, 'r' ) as f:
+        return json.load( f )
+
+def saveConfig( config_file, config ):
+    import json
+
+    with open( config_file, 'w' ) as f:
+        json.dump( config, f )
+
+def schemeCacheFilename( config_file ):
+    # the compiled schemes are saved next to the config file
+    return config_file.with_suffix( '.cache' )
+
+def schemeCacheKey( config_file ):
+    # the cache is only used with the config file it was made from
+    # and the version of colour_filter and python that made it
+    stat = os.stat( config_file )
+    return (scheme_cache_format, colour_filter.VERSION, sys.hexversion, stat.st_mtime_ns, stat.st_size)
+
+def saveSchemeCache( config_file, config, debug ):
+    '''
+    compile all the schemes in config for text and bytes mode
+    and save them into the scheme cache. Returns the cache.
+
+    When the cache cannot be saved nothing is compiled and
+    the cache returned has no compiled schemes.
+    '''
+    # tempfile is only needed when the scheme cache is rebuilt
+    import tempfile
+
+    cache_filename = schemeCacheFilename( config_file )
+    try:
+        # each process writes its own temporary file so that filters
+        # started at the same time do not overwrite each other's cache
+        fd, tmp_filename = tempfile.mkstemp( dir=str( cache_filename.parent ), prefix=cache_filename.name, suffix='.tmp' )
+
+    except OSError as e:
+        debug( 'Cannot save scheme cache %s: %s' % (cache_filename, e) )
+        return {
+            'key': None,
+            'all_scheme_names': sorted( config.keys() ),
+            'all_compiled': {},
+            }
+
+    all_compiled = {}
+    for scheme in config:
+        for binary in (False, True):
+            cf = colour_filter.ColourFilter( binary=binary )
+            try:
+                for pattern, colour in config[ scheme ]:
+                    cf.define( pattern, colour )
+
+            except colour_filter.ColourFilterError as e:
+                # the error is reported if the scheme is used
+                debug( 'Scheme %s not cached: %s' % (scheme, e) )
+                continue
+
+            all_compiled[ (scheme, binary) ] = cf.compiledForm()
+
+    scheme_cache = {
+        'key': schemeCacheKey( config_file ),
+        'all_scheme_names': sorted( config.keys() ),
+        'all_compiled': all_compiled,
+        }
+
+    try:
+        with os.fdopen( fd, 'wb' ) as f:
+            marshal.dump( scheme_cache, f )
+
+        os.replace( tmp_filename, cache_filename )
+
+    except OSError as e:
+        debug( 'Cannot save scheme cache %s: %s' % (cache_filename, e) )
+        try:
+            os.unlink( tmp_filename )
+
+        except OSError:
+            pass
+
+    return scheme_cache
+
+def loadSchemeCache( config_file, debug ):
+    # return the scheme cache for config_file, the cache is rebuilt if it is out of date
+    try:
+        with open( schemeCacheFilename( config_file ), 'rb' ) as f:
+            scheme_cache = marshal.load( f )
+
+        if isinstance( scheme_cache, dict ) and scheme_cache.get( 'key' ) == schemeCacheKey( config_file ):
+            return scheme_cache
+
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    debug( 'Rebuilding scheme cache for %s' % (config_file,) )
+    return saveSchemeCache( config_file, loadConfig( config_file ), debug )
+
 def main():
     args = iter( sys.argv )
     prog_name = next( args )
 
     opt_cmd = None
     opt_scheme = None
+    opt_debug = False
+    opt_line_buffered = sys.stdout.isatty()
+    opt_bytes = False
+    opt_stats = False
+    opt_search_budget = None
+    opt_max_line_length = None
+    opt_line_cache = None
+    opt_only_matching_lines = False
+    opt_context = 0
+    opt_follow = False
+    all_follow_commands = []
 
     all_filters = []
+    all_positional_args = []
+    all_files = []
 
     ct = colour_text.ColourText()
-    cf = colour_filter.ColourFilter()
 
     ct.initTerminal()
 
@@ -52,9 +202,14 @@ def main():
             if arg is None:
                 break
 
+            if arg == '--':
+                # the rest of the args are files
+                all_files.extend( args )
+                break
+
             if arg.startswith( '-' ):
                 if arg == '--debug':
-                    cf.enableDebug()
+                    opt_debug = True
 
                 elif arg in ('-h', '--help'):
                     usage( ct, cfg_path.saveFilePath() )
@@ -72,6 +227,58 @@ def main():
                 elif arg in ('-l', '--list-schemes'):
                     opt_cmd = 'list'
 
+                elif arg == '--line-buffered':
+                    opt_line_buffered = True
+
+                elif arg == '--bytes':
+                    opt_bytes = True
+
+                elif arg == '--stats':
+                    opt_stats = True
+
+                elif arg in ('-f', '--follow'):
+                    opt_follow = True
+
+                elif arg == '--command':
+                    opt_follow = True
+                    all_follow_commands.append( next( args ) )
+
+                elif arg == '--only-matching-lines':
+                    opt_only_matching_lines = True
+
+                elif arg in ('--search-budget', '--max-line-length', '--line-cache', '--context'):
+                    value = next( args )
+                    try:
+                        if arg == '--search-budget':
+                            opt_search_budget = float( value )
+                            if opt_search_budget <= 0:
+                                print( ct('<>error Error:<> %s must be more than 0 seconds not "%s"') % (arg, value) )
+                                return 1
+
+                        elif arg == '--max-line-length':
+                            opt_max_line_length = int( value )
+                            if opt_max_line_length < 1:
+                                print( ct('<>error Error:<> %s must be at least 1 not "%s"') % (arg, value) )
+                                return 1
+
+                        elif arg == '--line-cache':
+                            opt_line_cache = int( value )
+                            if opt_line_cache < 1:
+                                print( ct('<>error Error:<> %s must be at least 1 not "%s"') % (arg, value) )
+                                return 1
+
+                        else:
+                            opt_context = int( value )
+                            if opt_context < 0:
+                                print( ct('<>error Error:<> %s must not be negative not "%s"') % (arg, value) )
+                                return 1
+
+                            opt_only_matching_lines = True
+
+                    except ValueError:
+                        print( ct('<>error Error:<> %s needs a number not "%s"') % (arg, value) )
+                        return 1
+
                 elif arg in ('-sa', '-as'):
                     opt_cmd = 'add'
                     opt_scheme = next(args)
@@ -85,10 +292,22 @@ def main():
                     return 1
 
             else:
-                pattern = arg
-                colour = next( args )
+                all_positional_args.append( arg )
+
+        if opt_scheme is not None and opt_cmd is None:
+            # colour-filter -s scheme file...
+            all_files[0:0] = all_positional_args
+
+        else:
+            all_pairs = iter( all_positional_args )
+            for pattern in all_pairs:
+                colour = next( all_pairs )
                 all_filters.append( (pattern, colour) )
-                cf.define( pattern, colour )
+
+        cf = colour_filter.ColourFilter( binary=opt_bytes )
+        cf.enableDebug( opt_debug )
+        for pattern, colour in all_filters:
+            cf.define( pattern, colour )
 
         if opt_cmd == 'add':
             if opt_scheme is None:
@@ -103,15 +322,10 @@ def main():
             print( ct('<>error Error:<> --delete requires a --scheme') )
             return 1
 
-        config = {}
-
-        # load the config
         config_file = cfg_path.readFilePath()
-        if config_file is not None:
-            with open( config_file, 'r' ) as f:
-                config = json.load( f )
 
         if opt_cmd == 'list':
+            config = loadConfig( config_file )
             if len(config) == 0:
                 print( 'No schemes are defined' )
                 return 0
@@ -124,40 +338,101 @@ def main():
             return 0
 
         if opt_cmd == 'add':
+            config = loadConfig( config_file )
             config[opt_scheme] = all_filters
 
             config_file = cfg_path.saveFilePath()
-            with open( config_file, 'w' ) as f:
-                json.dump( config, f )
+            saveConfig( config_file, config )
+
+            saveSchemeCache( config_file, config, cf.debug )
 
             print( ct('Added scheme <>em %s<> with %d definitions') % (opt_scheme, len(config[opt_scheme])) )
             return 0
 
         if opt_cmd == 'delete':
+            config = loadConfig( config_file )
             if opt_scheme in config:
                 del config[opt_scheme]
 
             config_file = cfg_path.saveFilePath()
-            with open( config_file, 'w' ) as f:
-                json.dump( config, f )
+            saveConfig( config_file, config )
+
+            saveSchemeCache( config_file, config, cf.debug )
 
             print( ct('Deleted scheme <>em %s<>') % (opt_scheme,) )
             return 0
 
-        if opt_scheme is None and len(config) >= 1:
+        # the scheme cache has the schemes already checked and compiled
+        all_scheme_names = []
+        if config_file is not None:
+            scheme_cache = loadSchemeCache( config_file, cf.debug )
+            all_scheme_names = scheme_cache['all_scheme_names']
+
+        if opt_scheme is None and len(all_scheme_names) >= 1:
             # default to the first scheme
-            opt_scheme = sorted( config.keys() )[0]
+            opt_scheme = all_scheme_names[0]
 
         if opt_scheme is not None:
-            if opt_scheme not in config:
-                print( ct('<>error Error: Unknown scheme %s') % (opt_scheme,) )
+            if opt_scheme not in all_scheme_names:
+                print( ct('<>error Error:<> Unknown scheme %s') % (opt_scheme,) )
                 return 1
 
-            for pattern, colour in config[opt_scheme]:
-                cf.define( pattern, colour )
+            compiled_form = scheme_cache['all_compiled'].get( (opt_scheme, opt_bytes) )
+            if compiled_form is not None:
+                cf.defineCompiled( compiled_form )
 
-        cf.filterLines( sys.stdin, sys.stdout, line_buffered=True )
-        return 0
+            else:
+                # not cached because it has an error, define() reports it,
+                # or because the cache cannot be saved
+                for pattern, colour in loadConfig( config_file )[opt_scheme]:
+                    cf.define( pattern, colour )
+
+        if opt_search_budget is not None or opt_max_line_length is not None:
+            cf.setSearchBudget( opt_search_budget if opt_search_budget is not None else 0.1, opt_max_line_length )
+
+        if opt_line_cache is not None:
+            cf.enableLineCache( max_lines=opt_line_cache )
+
+        if opt_follow:
+            if opt_context > 0:
+                print( ct('<>error Error:<> --context cannot be used with --follow') )
+                return 1
+
+            def runFilter():
+                return followSources( ct, cf, all_files, all_follow_commands, opt_bytes, opt_only_matching_lines )
+
+        else:
+            if opt_only_matching_lines:
+                def filterMatchingLines( input_file, output_file ):
+                    cf.filterMatchingLines( input_file, output_file, opt_context, opt_line_buffered )
+
+            else:
+                filterMatchingLines = None
+
+            def runFilter():
+                return filterInput( ct, cf, all_files, opt_bytes, opt_line_buffered, filterMatchingLines )
+
+        if not opt_stats:
+            return runFilter()
+
+        def printStats( signum=None, frame=None ):
+            sys.stderr.write( cf.stats().report() )
+            line_cache = cf.lineCache()
+            if line_cache is not None:
+                sys.stderr.write( 'Line cache: %d hits %d misses\n' % (line_cache.hits, line_cache.misses) )
+            sys.stderr.flush()
+
+        import signal
+
+        cf.enableStats()
+        if hasattr( signal, 'SIGUSR1' ):
+            signal.signal( signal.SIGUSR1, printStats )
+
+        try:
+            return runFilter()
+
+        finally:
+            printStats()
 
     except StopIteration:
         print( ct('<>error Error:<> Need more args' ) )
@@ -170,5 +445,64 @@ def main():
     except KeyboardInterrupt:
         return 0
 
+def followSources( ct, cf, all_files, all_follow_commands, opt_bytes, opt_only_matching_lines ):
+    from colour_filter.follow import FollowSources
+
+    follow = FollowSources( cf, sys.stdout.buffer if opt_bytes else sys.stdout, only_matching_lines=opt_only_matching_lines )
+    try:
+        for filename in all_files:
+            follow.addFile( filename )
+
+    except OSError as e:
+        print( ct('<>error Error:<> %s') % (e,) )
+        return 1
+
+    for command in all_follow_commands:
+        follow.addCommand( command )
+
+    follow.run()
+    return 0
+
+def filterInput( ct, cf, all_files, opt_bytes, opt_line_buffered, filterMatchingLines ):
+    if opt_bytes:
+        input_file = sys.stdin.buffer
+        output_file = sys.stdout.buffer
+
+    else:
+        input_file = sys.stdin
+        output_file = sys.stdout
+
+    if len(all_files) > 0:
+        rc = 0
+        for filename in all_files:
+            try:
+                if filterMatchingLines is not None:
+                    with open( filename, 'rb' if opt_bytes else 'r' ) as input_file:
+                        filterMatchingLines( input_file, output_file )
+
+                else:
+                    cf.filterFile( filename, output_file )
+
+            except (FileNotFoundError, IsADirectoryError, PermissionError) as e:
+                print( ct('<>error Error:<> %s') % (e,) )
+                rc = 1
+
+        return rc
+
+    if filterMatchingLines is not None:
+        filterMatchingLines( input_file, output_file )
+
+    elif opt_line_buffered:
+        cf.filterLines( input_file, output_file, line_buffered=True )
+
+    elif opt_bytes:
+        # stdin redirected from a file with few lines to colour is mapped into memory
+        cf.filterMapped( input_file, output_file )
+
+    else:
+        cf.filterBlocks( input_file, output_file )
+
+    return 0
+
 if __name__ == '__main__':
     sys.exit( main() )
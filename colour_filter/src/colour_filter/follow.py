@@ -0,0 +1,257 @@
+'''
+    follow - follow files and the output of commands with one event loop,
+    colour each line with a ColourFilter and prefix it with a coloured tag
+    of the source it came from.
+'''
+import sys
+import os
+import codecs
+import struct
+import selectors
+import subprocess
+
+from colour_filter import colour_names, _sgr
+
+# colours of the source tags, used in turn
+all_tag_colours = ['cyan', 'magenta', 'yellow', 'blue', 'green', 'lightcyan', 'lightyellow', 'lightblue']
+
+# inotify event that a file has been written to or truncated
+IN_MODIFY = 0x00000002
+# struct inotify_event without its name
+inotify_event = struct.Struct( 'iIII' )
+
+class _Inotify:
+    '''
+    the inotify API of linux using ctypes
+    '''
+    def __init__( self ):
+        import ctypes
+
+        self.libc = ctypes.CDLL( None, use_errno=True )
+        self.fd = self.libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC )
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError( errno, os.strerror( errno ) )
+
+    def addWatch( self, filename ):
+        import ctypes
+
+        wd = self.libc.inotify_add_watch( self.fd, os.fsencode( filename ), IN_MODIFY )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError( errno, os.strerror( errno ), filename )
+
+        return wd
+
+    def readWatches( self ):
+        # return the set of watches that have events
+        all_watches = set()
+        try:
+            events = os.read( self.fd, 64*1024 )
+
+        except BlockingIOError:
+            return all_watches
+
+        index = 0
+        while index < len(events):
+            wd, mask, cookie, name_length = inotify_event.unpack_from( events, index )
+            all_watches.add( wd )
+            index += inotify_event.size + name_length
+
+        return all_watches
+
+    def close( self ):
+        os.close( self.fd )
+
+def _makeInotify():
+    # return an _Inotify or None when inotify is not available
+    if not sys.platform.startswith( 'linux' ):
+        return None
+
+    try:
+        return _Inotify()
+
+    except (OSError, AttributeError):
+        return None
+
+class _FileSource:
+    # a followed file never ends
+    can_end = False
+
+    def __init__( self, filename, tag ):
+        self.filename = filename
+        self.tag = tag
+        # like tail -f start with the text added after now
+        self.file = open( filename, 'rb' )
+        self.file.seek( 0, os.SEEK_END )
+
+    def read( self ):
+        # return all the text added to the file since the last read
+        if os.fstat( self.file.fileno() ).st_size < self.file.tell():
+            # the file was truncated
+            self.file.seek( 0 )
+
+        return self.file.read()
+
+    def close( self ):
+        self.file.close()
+
+class _CommandSource:
+    can_end = True
+
+    def __init__( self, command, tag ):
+        self.command = command
+        self.tag = tag
+        self.process = subprocess.Popen( command, shell=True,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+
+    def fileno( self ):
+        return self.process.stdout.fileno()
+
+    def read( self ):
+        # empty at end of file
+        return os.read( self.fileno(), 64*1024 )
+
+    def close( self ):
+        self.process.stdout.close()
+        self.process.wait()
+
+class FollowSources:
+    '''
+    follow files, like tail -f, and the output of commands with one event loop.
+    Each line is coloured by the colour_filter and written to the output_file
+    prefixed with the coloured tag of its source.
+
+    Files are watched with inotify on linux and checked every poll_interval
+    seconds otherwise. Following ends when all the commands have exited
+    and there are no files to follow. With only_matching_lines only the
+    lines that a pattern matched are written.
+    '''
+    def __init__( self, colour_filter, output_file, poll_interval=1.0, only_matching_lines=False ):
+        self.colour_filter = colour_filter
+        self.output_file = output_file
+        self.poll_interval = poll_interval
+        self.only_matching_lines = only_matching_lines
+        self.binary = colour_filter.binary
+
+        self.all_file_sources = []
+        self.all_command_sources = []
+
+        # the parts of the last line of each source that has no newline yet
+        self.all_partial_parts = {}
+        # text mode decoders of each source
+        self.all_decoders = {}
+
+    def addFile( self, filename, tag=None ):
+        if tag is None:
+            tag = os.path.basename( filename )
+
+        self.all_file_sources.append( _FileSource( filename, self._tag( tag ) ) )
+
+    def addCommand( self, command, tag=None ):
+        if tag is None:
+            all_words = command.split()
+            tag = all_words[0] if len(all_words) > 0 else 'command'
+
+        self.all_command_sources.append( _CommandSource( command, self._tag( tag ) ) )
+
+    def _tag( self, tag ):
+        # the tag coloured with the next of the tag colours
+        all_sources = self.all_file_sources + self.all_command_sources
+        colour = colour_names[ all_tag_colours[ len(all_sources) % len(all_tag_colours) ] ]
+        tag = '%s[%s]%s ' % (_sgr( colour, False ), tag, _sgr( '', False ))
+        if self.binary:
+            return tag.encode( 'utf-8', 'surrogateescape' )
+
+        return tag
+
+    def run( self ):
+        inotify = None
+        if len(self.all_file_sources) > 0:
+            inotify = _makeInotify()
+
+        selector = selectors.DefaultSelector()
+        for source in self.all_command_sources:
+            selector.register( source.fileno(), selectors.EVENT_READ, source )
+
+        all_file_sources_by_watch = {}
+        timeout = None
+        if inotify is not None:
+            for source in self.all_file_sources:
+                all_file_sources_by_watch[ inotify.addWatch( source.filename ) ] = source
+
+            selector.register( inotify.fd, selectors.EVENT_READ, inotify )
+
+        elif len(self.all_file_sources) > 0:
+            timeout = self.poll_interval
+
+        try:
+            while len(self.all_command_sources) > 0 or len(self.all_file_sources) > 0:
+                for key, mask in selector.select( timeout ):
+                    if key.data is inotify:
+                        for wd in inotify.readWatches():
+                            if wd in all_file_sources_by_watch:
+                                self.readSource( all_file_sources_by_watch[ wd ] )
+
+                    elif not self.readSource( key.data ):
+                        # the command has exited
+                        selector.unregister( key.fd )
+                        key.data.close()
+                        self.all_command_sources.remove( key.data )
+
+                if timeout is not None:
+                    for source in self.all_file_sources:
+                        self.readSource( source )
+
+                self.output_file.flush()
+
+        finally:
+            selector.close()
+            if inotify is not None:
+                inotify.close()
+
+            for source in self.all_file_sources + self.all_command_sources:
+                source.close()
+
+    def readSource( self, source ):
+        # colour and write the lines read from source, return False at end of file
+        data = source.read()
+        at_eof = source.can_end and len(data) == 0
+
+        engine = self.colour_filter.engine()
+        if not self.binary:
+            if source not in self.all_decoders:
+                self.all_decoders[ source ] = codecs.getincrementaldecoder( 'utf-8' )( 'replace' )
+
+            data = self.all_decoders[ source ].decode( data, at_eof )
+
+        all_partial_parts = self.all_partial_parts.setdefault( source, [] )
+        all_partial_parts.append( data )
+        text = engine.empty.join( all_partial_parts )
+        del all_partial_parts[:]
+
+        end_of_lines = text.rfind( engine.newline ) + 1
+        if end_of_lines < len(text):
+            if at_eof:
+                # finish the last line of a command's output
+                text += engine.newline
+                end_of_lines = len(text)
+
+            else:
+                all_partial_parts.append( text[end_of_lines:] )
+
+        colourLine = engine.colourLine
+        all_parts = []
+        for line in engine.findLines( text, 0, end_of_lines ):
+            coloured_line = colourLine( line )
+            # colouring always makes a line longer
+            if self.only_matching_lines and len(coloured_line) == len(line):
+                continue
+
+            all_parts.append( source.tag )
+            all_parts.append( coloured_line )
+
+        if len(all_parts) > 0:
+            self.output_file.write( engine.empty.join( all_parts ) )
+
+        return not at_eof
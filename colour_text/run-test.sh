@@ -1,3 +1,38 @@
 #!/bin/bash
 set -e
 ${1} -m colour_text "<>green green<> <><> <>yellow %s<>" "Format example"
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf ${TMP_DIR}' EXIT
+
+function check_output {
+    if [ "${2}" != "${3}" ]
+    then
+        echo "${1} output differs"
+        echo "Expected: ${2}" | cat -v
+        echo "Actual:   ${3}" | cat -v
+        exit 1
+    fi
+}
+
+cat <<EOF >${TMP_DIR}/input
+<>info Info:<> step 1 done
+plain <><> text
+EOF
+
+plain=$'Info: step 1 done\nplain <> text'
+coloured=$'\e[32mInfo:\e[m step 1 done\nplain <> text'
+
+# --stdin and -f convert each line, the markup is removed without colour
+check_output "--stdin" "${plain}" "$( NO_COLOR=1 ${1} -m colour_text --stdin <${TMP_DIR}/input )"
+check_output "-f" "${plain}" "$( NO_COLOR=1 ${1} -m colour_text -f ${TMP_DIR}/input )"
+check_output "--stdin with colour" "${coloured}" "$( FORCE_COLOR=1 ${1} -m colour_text --stdin <${TMP_DIR}/input )"
+check_output "-f with colour" "${coloured}" "$( FORCE_COLOR=1 ${1} -m colour_text -f ${TMP_DIR}/input )"
+
+# the coproc example from the help, its output is on stderr
+actual=$( FORCE_COLOR=1 bash -c '
+coproc CP { '${1}' -m colour_text --stdin >&2; }
+cat '${TMP_DIR}'/input >&${CP[1]}
+exec {CP[1]}>&-; wait ${CP_PID}
+' 2>&1 )
+check_output "coproc" "${coloured}" "${actual}"
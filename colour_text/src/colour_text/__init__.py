@@ -4,6 +4,8 @@
 VERSION = '1.0.5'
 
 import sys
+import os
+import collections
 
 colour_names = {
     'bold':         '1',
@@ -40,10 +42,60 @@ colour_names = {
 class ColourTextError(Exception):
     pass
 
+def colourEnabled( stream=None ):
+    '''
+    return True if coloured text should be written to stream, default sys.stdout.
+    NO_COLOR turns colour off and FORCE_COLOR turns it on, otherwise colour
+    is used when the stream is a terminal and TERM is not dumb.
+    '''
+    if os.environ.get( 'NO_COLOR', '' ) != '':
+        return False
+
+    force_colour = os.environ.get( 'FORCE_COLOR', '' )
+    if force_colour != '':
+        return force_colour != '0'
+
+    if os.environ.get( 'TERM', '' ) == 'dumb':
+        return False
+
+    if stream is None:
+        stream = sys.stdout
+
+    try:
+        return stream.isatty()
+
+    except (AttributeError, ValueError):
+        # no isatty() or the stream is closed
+        return False
+
+class CompiledColourText:
+    '''
+    a template with its colour markup converted, returned by ColourText.compile()
+    '''
+    def __init__( self, template, text ):
+        self.template = template
+        self.text = text
+
+    def __str__( self ):
+        return self.text
+
+    def __repr__( self ):
+        return '<CompiledColourText %r>' % (self.template,)
+
+    def __mod__( self, args ):
+        # format the converted text, the args are not checked for markup
+        return self.text % args
+
 class ColourText:
-    def __init__( self, marker='<>' ):
+    def __init__( self, marker='<>', cache_size=256, colour=True ):
         self.marker = marker
         self.named_colours = colour_names.copy()
+        # when False the markup is removed and no colour is output
+        self.colour = colour
+
+        # the most recently used compiled templates
+        self.cache_size = cache_size
+        self.all_compiled = collections.OrderedDict()
 
         # define useful semantic names
         self.define( 'info', 'green' )
@@ -57,8 +109,20 @@ class ColourText:
             # turn on the console ANSI colour handling
             kernel32.SetConsoleMode( kernel32.GetStdHandle( -11 ), 7 )
 
+    def enableColour( self, enable=True ):
+        self.colour = enable
+        # compiled templates are for the old mode
+        self.all_compiled.clear()
+
+    def detectColour( self, stream=None ):
+        # turn colour on or off to suit stream, default sys.stdout, see colourEnabled()
+        self.enableColour( colourEnabled( stream ) )
+        return self.colour
+
     def define( self, name, colour_def ):
         self.named_colours[ name ] = self._toSgr( colour_def )
+        # compiled templates may use the old colour
+        self.all_compiled.clear()
 
     def _toSgr( self, colour_def ):
         if type(colour_def) == str:
@@ -80,7 +144,38 @@ class ColourText:
 
         return ';'.join( all_sgr )
 
+    def compile( self, colour_text ):
+        '''
+        return a CompiledColourText of colour_text with the colour markup
+        converted. The last cache_size compiled templates are reused.
+        '''
+        compiled = self.all_compiled.get( colour_text )
+        if compiled is not None:
+            self.all_compiled.move_to_end( colour_text )
+            return compiled
+
+        compiled = CompiledColourText( colour_text, self._convert( colour_text ) )
+        if self.cache_size > 0:
+            self.all_compiled[ colour_text ] = compiled
+            if len(self.all_compiled) > self.cache_size:
+                self.all_compiled.popitem( last=False )
+
+        return compiled
+
     def convert( self, colour_text ):
+        return self.compile( colour_text ).text
+
+    def format( self, colour_text, **values ):
+        # convert colour_text then fill in its %(name)s slots with values.
+        # the values are never checked for colour markup
+        return self.compile( colour_text ) % values
+
+    def render( self, colour_text, *args ):
+        # convert colour_text then fill in its %s slots with args.
+        # the args are never checked for colour markup
+        return self.compile( colour_text ) % args
+
+    def _convert( self, colour_text ):
         all_parts = colour_text.split( self.marker )
         state = 'plain'
         all_converted_text = []
@@ -90,6 +185,9 @@ class ColourText:
         if (len(all_parts) % 2) != 1:
             raise ColourTextError( 'Expecting pairs of the marker %r in %r' % (self.marker, colour_text ) )
 
+        if not self.colour:
+            return self._convertToPlain( all_parts )
+
         for part in all_parts:
             if state == 'plain':
                 all_converted_text.append( part )
@@ -119,9 +217,133 @@ class ColourText:
         return ''.join( all_converted_text )
 
 
+    def _convertToPlain( self, all_parts ):
+        # remove the markup leaving the text, the colour names are not checked
+        all_plain_text = [all_parts[0]]
+        for index in range( 1, len(all_parts), 2 ):
+            part = all_parts[ index ]
+            if len(part) == 0:
+                all_plain_text.append( self.marker )
+
+            else:
+                name_text = part.split( ' ', 1 )
+                if len(name_text) != 2:
+                    raise ColourTextError( 'Expecting colour name and text in %r' % (part,) )
+
+                all_plain_text.append( name_text[1] )
+
+            all_plain_text.append( all_parts[ index+1 ] )
+
+        return ''.join( all_plain_text )
+
     def __call__( self, colour_text ):
         return self.convert( colour_text )
 
+class ColourWriter:
+    '''
+    write lines of colour markup to several targets, each with or without colour,
+    for example a terminal and a log file. The lines are kept in a buffer
+    and written when flush_size characters are waiting, flush_interval
+    seconds after the first waiting line, when an important line is written
+    and on flush() or close().
+    '''
+    def __init__( self, ct, flush_interval=0.25, flush_size=64*1024 ):
+        self.ct = ct
+        # used for the targets that have no colour
+        self.plain_ct = ColourText( marker=ct.marker, colour=False )
+
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        # list of [file, colour, all_pending_text]
+        self.all_targets = []
+        self.pending_size = 0
+        self.timer = None
+        # threading is only imported by the commands that use a ColourWriter
+        import threading
+        self.threading = threading
+        self.lock = threading.RLock()
+
+        # counters to help tune the thresholds
+        self.lines = 0
+        self.flushes = 0
+        self.target_writes = 0
+
+    def addTarget( self, file, colour=None ):
+        # colour defaults to colourEnabled( file )
+        if colour is None:
+            colour = colourEnabled( file )
+
+        with self.lock:
+            self.all_targets.append( [file, colour, []] )
+
+    def removeTarget( self, file ):
+        # write the lines waiting for file and stop writing to it
+        with self.lock:
+            self.flush()
+            self.all_targets = [target for target in self.all_targets if target[0] is not file]
+
+    def writeLine( self, colour_text, important=False, target=None ):
+        # write the line with its colour markup converted, only to target if given
+        with self.lock:
+            self._append( self.ct.compile( colour_text ), self.plain_ct.compile( colour_text ), None, important, target )
+
+    def renderLine( self, colour_text, *args, important=False, target=None ):
+        # write the line like ColourText.render(), args are not checked for markup
+        with self.lock:
+            self._append( self.ct.compile( colour_text ), self.plain_ct.compile( colour_text ), args, important, target )
+
+    def _append( self, colour_line, plain_line, args, important, target ):
+        if args is not None:
+            colour_line = colour_line % args
+            plain_line = plain_line % args
+
+        colour_line = '%s\n' % (colour_line,)
+        plain_line = '%s\n' % (plain_line,)
+
+        for file, colour, all_pending_text in self.all_targets:
+            if target is None or file is target:
+                all_pending_text.append( colour_line if colour else plain_line )
+
+        self.lines += 1
+        self.pending_size += len(colour_line)
+
+        if important or self.pending_size >= self.flush_size:
+            self.flush()
+
+        elif self.timer is None:
+            self.timer = self.threading.Timer( self.flush_interval, self.flush )
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush( self ):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if self.pending_size == 0:
+                return
+
+            self.flushes += 1
+            for target in self.all_targets:
+                file, colour, all_pending_text = target
+                if len(all_pending_text) > 0:
+                    file.write( ''.join( all_pending_text ) )
+                    file.flush()
+                    self.target_writes += 1
+                    target[2] = []
+
+            self.pending_size = 0
+
+    def close( self ):
+        self.flush()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
 
 def main( argv ):
     ct = ColourText()
@@ -6,6 +6,7 @@ import colour_text
 
 usage = '''<>green Usage:<>  %(progname)s <>white string<>
         %(progname)s [<>yellow -m<><>white marker<>] <>white string<> [<>white arg<>]...
+        %(progname)s [<>yellow -m<><>white marker<>] <>yellow --stdin<> | <>yellow -f<> <>white file<>
         %(progname)s <>yellow -h<> | <>yellow --help<>
 
 %(progname)s is a command that makes printing coloured text
@@ -25,6 +26,9 @@ The first argument is treated as a format string if there are more arguments.
     $ %(progname)s "<><>info Info:<><> Home folder is %%s" "$HOME"
     <>info Info:<> Home folder is /home/barry
 
+Colour is only output to a terminal. Set NO_COLOR to turn colour off
+and FORCE_COLOR to turn it on.
+
 The colour-name can be made up of multiple names seperated by ";".
 
     $ %(progname)s "<><>lightyellow;bg-blue yellow on blue background <><>"
@@ -36,6 +40,18 @@ Options:
     <>yellow --help<>, <>yellow -h<>  This help text
     <>yellow -m<><>white marker<>    set the marker to the string <>white marker<>
                 The default marker is <><>.
+    <>yellow --stdin<>     convert each line read from stdin
+    <>yellow -f<> <>white file<>     convert each line of <>white file<>
+
+With <>yellow --stdin<> a script can start one %(progname)s and send it all of its
+messages instead of running %(progname)s for every message.
+The stdout of a coproc is a pipe back to the script, so send
+the output to the terminal on stderr. Close the pipe and wait
+at the end of the script so that the last lines are written.
+
+    coproc CP { %(progname)s --stdin >&2; }
+    echo "<><>info Info:<><> step 1 done" >&${CP[1]}
+    exec {CP[1]}>&-; wait ${CP_PID}
 
 Colour-names that start with "bg-" are blackground colours.
 The semantic colour-names are "info", "error" and "em" (emphasis).
@@ -47,9 +63,11 @@ The builtin colour-names are:
 def main( argv=None ):
     msg_ct = colour_text.ColourText()
     msg_ct.initTerminal()
+    msg_ct.detectColour()
 
     marker = '<>'
     text_args = []
+    input_filename = None
 
     if argv is None:
         argv = sys.argv
@@ -91,6 +109,15 @@ def main( argv=None ):
 
             return 0
 
+        elif arg == '--stdin':
+            input_filename = '-'
+
+        elif arg == '-f':
+            input_filename = next( args, None )
+            if input_filename is None:
+                print( 'Expecting value of -f' )
+                return 1
+
         elif arg.startswith( '-m' ):
             marker = arg[len('-m'):]
             if marker == '':
@@ -101,7 +128,10 @@ def main( argv=None ):
             text_args.append( arg )
 
     try:
-        ct = colour_text.ColourText( marker=marker )
+        ct = colour_text.ColourText( marker=marker, colour=msg_ct.colour )
+
+        if input_filename is not None:
+            return convertLines( msg_ct, ct, input_filename )
 
         if len(text_args) == 0:
             print()
@@ -125,5 +155,34 @@ def main( argv=None ):
         print( msg_ct( '<>error Error: %s<>') % (e,) )
         return 2
 
+def convertLines( msg_ct, ct, input_filename ):
+    # convert each line of input_filename, - for stdin, with one ColourText
+    # and write them through a buffered ColourWriter
+    if input_filename == '-':
+        input_file = sys.stdin
+
+    else:
+        try:
+            input_file = open( input_filename )
+
+        except OSError as e:
+            print( msg_ct( '<>error Error: %s<>') % (e,) )
+            return 1
+
+    rc = 0
+    with input_file, colour_text.ColourWriter( ct ) as writer:
+        writer.addTarget( sys.stdout, colour=ct.colour )
+
+        for line in input_file:
+            try:
+                writer.writeLine( line.rstrip( '\n' ) )
+
+            except colour_text.ColourTextError as e:
+                writer.flush()
+                print( msg_ct( '<>error Error: %s<>') % (e,), file=sys.stderr )
+                rc = 1
+
+    return rc
+
 if __name__ == '__main__':
     sys.exit( main() )
@@ -0,0 +1,151 @@
+#!/bin/bash
+set -e
+DUMP=$(dirname "$0")/src/dump.py
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf ${TMP_DIR}' EXIT
+
+# the original one row at a time dump, with a start offset added, is the reference format
+cat <<EOF >${TMP_DIR}/reference.py
+import sys
+
+batch_size = 16
+
+def main( argv ):
+    offset = int( argv[2], 16 )
+    limit = int( argv[3], 16 )
+
+    f = open( argv[1], 'rb' )
+    f.seek( offset )
+
+    while offset < limit:
+        all_parts = []
+        buf = f.read( batch_size )
+        if len(buf) == 0:
+            break
+
+        if len( buf ) < batch_size:
+            buf = buf + (b'\x00' * batch_size)
+
+        for i in range( batch_size-1, -1, -1 ):
+            all_parts.append( '%2.2x' % (buf[i],) )
+
+        all_parts.append( ' %8.8x ' % (offset,) )
+
+        all_str = []
+        for i in range( batch_size ):
+            r = repr( buf[i:i+1] )
+            if len(r) != 4:
+                all_str.append( '.' )
+            else:
+                all_str.append( r[2] )
+
+        all_parts.append( ''.join( all_str ) )
+
+        print( '%s %s %s %s-%s %s %s %s-%s %s %s %s-%s %s %s %s  %s  %s' % tuple( all_parts ) )
+
+        offset += batch_size
+
+sys.exit( main( sys.argv ) )
+EOF
+
+# compare_with_reference <python> <file> <offset> <limit> <dump args>, <offset> and <limit> are hex
+function compare_with_reference {
+    expected=$( ${1} ${TMP_DIR}/reference.py ${2} ${3} ${4} )
+    actual=$( ${1} ${DUMP} "${@:5}" )
+    if [ "${expected}" != "${actual}" ]
+    then
+        echo "Dump differs for ${*:5}"
+        diff <( echo "${expected}" ) <( echo "${actual}" ) | head -10
+        exit 1
+    fi
+}
+
+# odd sizes, including part rows and part blocks
+for size in 0 1 15 16 17 255 4097 65535 65537 200001
+do
+    ${1} -c "import sys; sys.stdout.buffer.write( bytes( (i * 7 + i // 256) % 256 for i in range( ${size} ) ) )" >${TMP_DIR}/data
+    compare_with_reference ${1} ${TMP_DIR}/data 0 100000000 ${TMP_DIR}/data
+done
+
+# the limit is rounded up to a whole row
+compare_with_reference ${1} ${TMP_DIR}/data 0 35 ${TMP_DIR}/data 35
+compare_with_reference ${1} ${TMP_DIR}/data 0 10000 ${TMP_DIR}/data 10000
+
+# offsets at and above 2**32 need more than 8 hex digits
+${1} -c "
+with open( '${TMP_DIR}/sparse', 'wb' ) as f:
+    f.truncate( 2**32 + 0x45 )
+    f.seek( 2**32 - 0x23 )
+    f.write( bytes( range( 0x40 ) ) )
+"
+compare_with_reference ${1} ${TMP_DIR}/sparse ffffff00 200000000 --offset 0xffffff00 ${TMP_DIR}/sparse
+compare_with_reference ${1} ${TMP_DIR}/sparse 100000000 200000000 --offset 0x100000000 ${TMP_DIR}/sparse
+compare_with_reference ${1} ${TMP_DIR}/sparse fffffff0 100000010 --offset 0xfffffff0 --length 0x20 ${TMP_DIR}/sparse
+
+function check_output {
+    if [ "${2}" != "${3}" ]
+    then
+        echo "${1} output differs"
+        diff <( echo "${2}" ) <( echo "${3}" ) | head -10
+        exit 1
+    fi
+}
+
+# --find dumps the rows around the needle, the same rows as dumping them with --offset
+${1} -c "import sys; sys.stdout.buffer.write( bytes( (i * 7 + i // 256) % 256 for i in range( 4096 ) ) + b'needle' + bytes( 100 ) )" >${TMP_DIR}/data
+compare_with_reference ${1} ${TMP_DIR}/data ff0 1020 --find needle ${TMP_DIR}/data
+compare_with_reference ${1} ${TMP_DIR}/data fd0 1040 --find 0x6e6565646c65 --context 3 ${TMP_DIR}/data
+compare_with_reference ${1} ${TMP_DIR}/data 1000 1010 --find needle --context 0 ${TMP_DIR}/data
+check_output "--find not found" "" "$( ${1} ${DUMP} --find haystack ${TMP_DIR}/data )"
+
+# -s replaces the repeated rows with * and writes the end offset when the dump ends in a * line
+${1} -c "import sys; sys.stdout.buffer.write( b'a' * 16 + bytes( 64 ) + b'b' * 5 )" >${TMP_DIR}/squeeze
+squeezed_rows='61 61 61 61-61 61 61 61-61 61 61 61-61 61 61 61   00000000   aaaaaaaaaaaaaaaa
+00 00 00 00-00 00 00 00-00 00 00 00-00 00 00 00   00000010   ................
+*'
+check_output "-s" "${squeezed_rows}
+00 00 00 00-00 00 00 00-00 00 00 62-62 62 62 62   00000050   bbbbb..........." "$( ${1} ${DUMP} -s ${TMP_DIR}/squeeze )"
+check_output "-s at the end" "${squeezed_rows}
+00000050" "$( ${1} ${DUMP} -s ${TMP_DIR}/squeeze 50 )"
+# each group of rows found is squeezed on its own
+${1} -c "import sys; sys.stdout.buffer.write( b'a' * 16 + bytes( 128 ) + b'b' * 5 )" >${TMP_DIR}/squeeze
+check_output "-s --find" "${squeezed_rows}
+00000030
+--
+00 00 00 00-00 00 00 00-00 00 00 00-00 00 00 00   00000070   ................
+*
+00 00 00 00-00 00 00 00-00 00 00 62-62 62 62 62   00000090   bbbbb..........." "$( ${1} ${DUMP} -s --find a --find b --context 2 ${TMP_DIR}/squeeze )"
+
+# the holes of a sparse file are one * hole line, if the file system has holes
+${1} -c "
+with open( '${TMP_DIR}/holes', 'wb' ) as f:
+    f.write( b'a' * 16 )
+    f.truncate( 2**20 )
+"
+check_output "-s holes" "00100000" "$( ${1} ${DUMP} -s ${TMP_DIR}/holes | tail -1 )"
+compare_with_reference ${1} ${TMP_DIR}/holes 0 100000 ${TMP_DIR}/holes
+
+# --as matches the values unpacked by struct
+${1} -c "import sys; sys.stdout.buffer.write( bytes( (i * 37 + 11) % 256 for i in range( 100 ) ) )" >${TMP_DIR}/values
+for value_type in u8 i8 u16 i16 u32 i32 u64 i64 f32 f64
+do
+    for endian in little big
+    do
+        expected=$( ${1} -c "
+import struct, sys
+code, value_format = dict( u8=('B', '%3d'), i8=('b', '%4d'), u16=('H', '%5d'), i16=('h', '%6d'),
+    u32=('I', '%10d'), i32=('i', '%11d'), u64=('Q', '%20d'), i64=('q', '%20d'),
+    f32=('f', '%15.7g'), f64=('d', '%24.17g') )[ '${value_type}' ]
+row_size = struct.calcsize( code ) * 3
+buf = open( '${TMP_DIR}/values', 'rb' ).read()
+buf += bytes( -len(buf) % row_size )
+for offset in range( 0, len(buf), row_size ):
+    row = buf[offset:offset + row_size]
+    all_values = struct.unpack( '%s3%s' % ('<' if '${endian}' == 'little' else '>', code), row )
+    text = ''.join( chr( b ) if 32 <= b < 127 else '.' for b in row )
+    print( ' '.join( value_format % (value,) for value in all_values ) + '   %8.8x   %s' % (offset, text) )
+" )
+        check_output "--as ${value_type} --endian ${endian}" "${expected}" "$( ${1} ${DUMP} --as ${value_type} --endian ${endian} --width 3 ${TMP_DIR}/values )"
+    done
+done
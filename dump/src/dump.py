@@ -1,48 +1,559 @@
-#!/usr/bin/python3
-import sys
-
-batch_size = 16
-
-def main( argv ):
-    offset = 0
-    limit = 2**32
-
-    if len(argv) <= 1:
-        print( 'Usage: dump <filename> [<limit>]' )
-        return 1
-
-    f = open( argv[1], 'rb' )
-
-    if len(argv) > 2:
-        limit = int( argv[2], 16 )
-
-    while offset < limit:
-        all_parts = []
-        buf = f.read( batch_size )
-        if len(buf) == 0:
-            break
-
-        if len( buf ) < batch_size:
-            buf = buf + (b'\x00' * batch_size)
-
-        for i in range( batch_size-1, -1, -1 ):
-            all_parts.append( '%2.2x' % (buf[i],) )
-
-        all_parts.append( ' %8.8x ' % (offset,) )
-
-        all_str = []
-        for i in range( batch_size ):
-            r = repr( buf[i:i+1] )
-            if len(r) != 4:
-                all_str.append( '.' )
-            else:
-                all_str.append( r[2] )
-
-        all_parts.append( ''.join( all_str ) )
-
-        print( '%s %s %s %s-%s %s %s %s-%s %s %s %s-%s %s %s %s  %s  %s' % tuple( all_parts ) )
-
-        offset += batch_size
-
-if __name__ == '__main__':
-    sys.exit( main( sys.argv ) )
+#!/usr/bin/python3
+import sys
+import os
+import errno
+import mmap
+import array
+import heapq
+
+batch_size = 16
+# bytes read and formatted at once, a multiple of batch_size
+block_size = 64*1024
+
+# a row is the hex of its bytes in reverse order with a - between each 4 bytes,
+# the offset and the bytes as text
+#   0f 0e 0d 0c-0b 0a 09 08-07 06 05 04-03 02 01 00   00000000   ................
+hex_size = 3
+offset_column = batch_size * hex_size + 2
+all_dash_columns = range( 4*hex_size - 1, (batch_size - 1) * hex_size, 4*hex_size )
+
+# tables that map a byte to the first and second digit of its hex
+hex_digits = b'0123456789abcdef'
+hex_high_table = bytes( hex_digits[ byte >> 4 ] for byte in range( 256 ) )
+hex_low_table = bytes( hex_digits[ byte & 0xf ] for byte in range( 256 ) )
+# maps the bytes that are not shown in the text column to .
+printable_table = bytes( byte if 0x20 <= byte < 0x7f and byte != ord('\\') else ord('.') for byte in range( 256 ) )
+
+# the array type code and format of each type of value that --as can show
+all_value_types = {
+    'u8':   ('B', '%3d'),
+    'i8':   ('b', '%4d'),
+    'u16':  ('H', '%5d'),
+    'i16':  ('h', '%6d'),
+    'u32':  ('I', '%10d'),
+    'i32':  ('i', '%11d'),
+    'u64':  ('Q', '%20d'),
+    'i64':  ('q', '%20d'),
+    'f32':  ('f', '%15.7g'),
+    'f64':  ('d', '%24.17g'),
+    }
+
+def usage():
+    print( '''Usage: dump <options> <filename> [<limit>]
+
+    <limit> is the hex offset to stop at, default 100000000 bytes after the start
+
+Options:
+    --offset <n>    - start at byte <n> of the file, default 0
+    --length <n>    - dump <n> bytes, rounded up to a whole row
+    -s, --squeeze   - replace rows that are the same as the row before with one *
+                      line and holes in sparse files with a * hole line. The end
+                      offset follows a * line at the end of the dump
+    --find <bytes>  - only dump the rows around each place <bytes> is found, can be
+                      used more than once. <bytes> is hex with a 0x prefix or text.
+                      Searches to the end of the file when there is no <limit> or --length
+    --context <n>   - dump <n> rows before and after the rows found, default 1
+    --as <type>     - dump each row as values of <type>, one of
+                      %s
+    --endian <e>    - the byte order of the values, little or big, default %s
+    --width <n>     - the number of values in a row, default 16 bytes of values
+
+    <n> is decimal or hex with a 0x prefix.
+''' % (' '.join( all_value_types ), sys.byteorder) )
+
+def main( argv ):
+    offset = 0
+    length = None
+    limit = None
+    squeeze = False
+    all_needles = []
+    context = 1
+    value_type = None
+    endian = sys.byteorder
+    width = None
+
+    all_positional = []
+    args = iter( argv[1:] )
+    try:
+        for arg in args:
+            if arg == '--offset':
+                offset = parseNumber( next( args ) )
+                if offset < 0:
+                    print( 'Error: --offset must not be negative' )
+                    return 1
+
+            elif arg == '--length':
+                length = parseNumber( next( args ) )
+                if length < 0:
+                    print( 'Error: --length must not be negative' )
+                    return 1
+
+            elif arg in ('-s', '--squeeze'):
+                squeeze = True
+
+            elif arg == '--find':
+                all_needles.append( parseNeedle( next( args ) ) )
+
+            elif arg == '--context':
+                context = parseNumber( next( args ) )
+                if context < 0:
+                    print( 'Error: --context must not be negative' )
+                    return 1
+
+            elif arg == '--as':
+                value_type = next( args )
+                if value_type not in all_value_types:
+                    print( 'Error: --as must be one of %s' % (', '.join( all_value_types ),) )
+                    return 1
+
+            elif arg == '--endian':
+                endian = next( args )
+                if endian not in ('little', 'big'):
+                    print( 'Error: --endian must be little or big' )
+                    return 1
+
+            elif arg == '--width':
+                width = parseNumber( next( args ) )
+                if width < 1:
+                    print( 'Error: --width must be at least 1' )
+                    return 1
+
+            elif arg in ('-h', '--help'):
+                usage()
+                return 0
+
+            elif arg.startswith( '-' ):
+                print( 'Error: Unknown option %s' % (arg,) )
+                return 1
+
+            else:
+                all_positional.append( arg )
+
+        if len(all_positional) not in (1, 2):
+            usage()
+            return 1
+
+        if len(all_positional) > 1:
+            limit = int( all_positional[1], 16 )
+
+    except StopIteration:
+        print( 'Error: Need more args' )
+        return 1
+
+    except ValueError as e:
+        print( 'Error: %s' % (e,) )
+        return 1
+
+    if length is not None:
+        limit = offset + length
+
+    elif limit is None:
+        limit = offset + (2**64 if len(all_needles) > 0 else 2**32)
+
+    if value_type is not None:
+        layout = ValueLayout( value_type, endian, width )
+
+    elif width is not None:
+        print( 'Error: --width needs --as' )
+        return 1
+
+    else:
+        layout = HexLayout()
+
+    writer = DumpWriter( sys.stdout.buffer, squeeze, layout )
+    row_size = layout.row_size
+    with open( all_positional[0], 'rb' ) as f:
+        dump_end = offset
+        if len(all_needles) > 0:
+            mapped = mapFile( f )
+            if mapped is None:
+                print( 'Error: --find needs a file that can be mapped' )
+                return 1
+
+            with mapped:
+                findRows( mapped, f.fileno(), all_needles, offset, limit, context, writer )
+
+            return 0
+
+        for start, length, buf in readBlocks( f, offset, limit, row_size ):
+            if buf is None:
+                writer.writeHole( start, length )
+
+            else:
+                if len(buf) % row_size != 0:
+                    # the last row is padded with zeros
+                    buf = buf + b'\x00' * (row_size - len(buf) % row_size)
+
+                writer.writeRows( buf, start )
+
+            dump_end = start + length
+
+    writer.finish( dump_end )
+    return 0
+
+def parseNumber( arg ):
+    if arg.lower().startswith( '0x' ):
+        return int( arg[2:], 16 )
+
+    return int( arg )
+
+def parseNeedle( arg ):
+    # hex with a 0x prefix or the UTF-8 of the text
+    if arg.lower().startswith( '0x' ):
+        needle = bytes.fromhex( arg[2:] )
+
+    else:
+        needle = arg.encode( 'utf-8' )
+
+    # an empty needle is found at every offset
+    if len(needle) == 0:
+        raise ValueError( '--find needs at least one byte' )
+
+    return needle
+
+def mapFile( f ):
+    # return f mapped into memory or None if it cannot be mapped
+    try:
+        return mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+
+    except (OSError, ValueError):
+        # pipes, devices and empty files
+        return None
+
+def findRows( mapped, fd, all_needles, offset, limit, context, writer ):
+    # dump the rows from offset to limit where any of all_needles are found with
+    # context rows before and after them. Groups of rows that are not next to each
+    # other are separated by a -- line
+    row_size = writer.layout.row_size
+    end = min( len(mapped), offset + (limit - offset + row_size - 1) // row_size * row_size )
+    if offset >= end:
+        return
+
+    # holes can only hold needles that are all zeros
+    if any( needle.count( 0 ) == len(needle) for needle in all_needles ):
+        all_extents = [(offset, end)]
+
+    else:
+        all_extents = list( dataExtents( fd, offset, end, row_size ) )
+
+    max_needle_length = max( len(needle) for needle in all_needles )
+
+    def findNeedle( needle ):
+        # yield the offset and length of each place needle is found
+        search_start = offset
+        for data_start, data_end in all_extents:
+            # a needle may start in the hole before the data and end in the hole after it
+            start = max( search_start, data_start - max_needle_length + 1 )
+            search_end = min( end, data_end + max_needle_length - 1 )
+            while True:
+                start = mapped.find( needle, start, search_end )
+                if start < 0:
+                    break
+
+                yield start, len(needle)
+                start += 1
+
+            # all the places that start before here have been searched
+            search_start = max( search_start, search_end - len(needle) + 1 )
+
+    group_start = None
+    group_end = None
+    for start, length in heapq.merge( *[findNeedle( needle ) for needle in all_needles] ):
+        # the rows that hold the needle and the context rows
+        rows_start = max( offset, offset + ((start - offset) // row_size - context) * row_size )
+        rows_end = min( end, offset + ((start + length - 1 - offset) // row_size + 1 + context) * row_size )
+
+        if group_end is not None and rows_start <= group_end:
+            group_end = max( group_end, rows_end )
+            continue
+
+        if group_start is not None:
+            writeMappedRows( mapped, group_start, group_end, writer )
+            writer.finish( group_end )
+            writer.output_file.write( b'--\n' )
+
+        group_start = rows_start
+        group_end = rows_end
+
+    if group_start is not None:
+        writeMappedRows( mapped, group_start, group_end, writer )
+        writer.finish( group_end )
+
+def writeMappedRows( mapped, start, end, writer ):
+    row_size = writer.layout.row_size
+    rows_block_size = rowsBlockSize( row_size )
+    for block_start in range( start, end, rows_block_size ):
+        buf = mapped[block_start:min( block_start + rows_block_size, end )]
+        if len(buf) % row_size != 0:
+            # the last row is padded with zeros
+            buf = buf + b'\x00' * (row_size - len(buf) % row_size)
+
+        writer.writeRows( buf, block_start )
+
+def rowsBlockSize( row_size ):
+    # the size of the whole number of rows read and formatted at once
+    return max( 1, block_size // row_size ) * row_size
+
+def readBlocks( f, offset, limit, row_size ):
+    # yield (start, length, buf) of the blocks of f from offset up to the row
+    # that contains limit, the last block may not be a whole number of rows.
+    # The rows that are in a hole of a sparse file are yielded with buf None.
+    # Files that can be mapped are read from offset without reading the bytes before it
+    end = offset + (limit - offset + row_size - 1) // row_size * row_size
+    rows_block_size = rowsBlockSize( row_size )
+    mapped = mapFile( f )
+    if mapped is not None:
+        with mapped:
+            end = min( end, len(mapped) )
+            for data_start, data_end in dataExtents( f.fileno(), offset, end, row_size ):
+                if data_start > offset:
+                    yield offset, data_start - offset, None
+
+                for start in range( data_start, data_end, rows_block_size ):
+                    buf = mapped[start:min( start + rows_block_size, data_end )]
+                    yield start, len(buf), buf
+
+                offset = data_end
+
+            if end > offset:
+                yield offset, end - offset, None
+
+        return
+
+    if f.seekable():
+        f.seek( offset )
+
+    else:
+        skip = offset
+        while skip > 0:
+            buf = f.read( min( skip, rows_block_size ) )
+            if len(buf) == 0:
+                return
+
+            skip -= len(buf)
+
+    while offset < end:
+        buf = f.read( min( rows_block_size, end - offset ) )
+        if len(buf) == 0:
+            break
+
+        yield offset, len(buf), buf
+
+        offset += len(buf)
+
+def dataExtents( fd, offset, end, row_size ):
+    # yield (start, end) of the rows from offset to end that hold data,
+    # the rows between them are all in holes of the file and need not be read
+    if not hasattr( os, 'SEEK_DATA' ):
+        yield offset, end
+        return
+
+    row_start = offset
+    while row_start < end:
+        try:
+            data_start = os.lseek( fd, row_start, os.SEEK_DATA )
+            data_end = os.lseek( fd, data_start, os.SEEK_HOLE )
+
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # only a hole after row_start
+                return
+
+            # SEEK_DATA is not supported
+            yield row_start, end
+            return
+
+        # the rows that contain the data
+        data_start = max( row_start, offset + (data_start - offset) // row_size * row_size )
+        data_end = min( end, offset + (data_end - offset + row_size - 1) // row_size * row_size )
+        if data_start >= end:
+            return
+
+        yield data_start, data_end
+        row_start = data_end
+
+def offsetWidth( offset ):
+    # the number of hex digits of offset in its column
+    return max( 8, len( '%x' % (offset,) ) )
+
+def formatRows( buf, offset ):
+    # return the dump of buf, a whole number of rows that starts at offset, as bytes.
+    # All the rows have the same layout so each column of the rows is filled in
+    # at once from a slice of buf with one stride
+    last_offset = offset + len(buf) - batch_size
+    width = offsetWidth( last_offset )
+    if offsetWidth( offset ) != width:
+        # the offsets get wider in buf, the rows either side have different layouts
+        split = (16**(width - 1) - offset + batch_size - 1) // batch_size * batch_size
+        return formatRows( buf[:split], offset ) + formatRows( buf[split:], offset + split )
+
+    rows = len(buf) // batch_size
+    text_column = offset_column + width + 3
+    line_size = text_column + batch_size + 1
+
+    all_rows = bytearray( b' ' * (rows * line_size) )
+    for index in range( batch_size ):
+        # the hex is in reverse order
+        column = (batch_size - 1 - index) * hex_size
+        all_bytes = buf[index::batch_size]
+        all_rows[column::line_size] = all_bytes.translate( hex_high_table )
+        all_rows[column + 1::line_size] = all_bytes.translate( hex_low_table )
+
+    for column in all_dash_columns:
+        all_rows[column::line_size] = b'-' * rows
+
+    # the offsets as 16 hex digits each
+    all_offsets = array.array( 'Q', range( offset, last_offset + 1, batch_size ) )
+    if sys.byteorder == 'little':
+        all_offsets.byteswap()
+
+    all_offset_digits = all_offsets.tobytes().hex().encode( 'ascii' )
+    for index in range( width ):
+        all_rows[offset_column + index::line_size] = all_offset_digits[16 - width + index::16]
+
+    text = buf.translate( printable_table )
+    for index in range( batch_size ):
+        all_rows[text_column + index::line_size] = text[index::batch_size]
+
+    all_rows[line_size - 1::line_size] = b'\n' * rows
+
+    return all_rows
+
+class HexLayout:
+    '''
+    rows of batch_size bytes shown as hex and text
+    '''
+    row_size = batch_size
+
+    def formatRows( self, buf, offset ):
+        return formatRows( buf, offset )
+
+class ValueLayout:
+    '''
+    rows of width values of value_type, a key of all_value_types,
+    with the offset and the bytes of the row as text
+    '''
+    def __init__( self, value_type, endian, width=None ):
+        self.code, value_format = all_value_types[ value_type ]
+        self.value_size = array.array( self.code ).itemsize
+        self.byteswap = endian != sys.byteorder
+
+        if width is None:
+            width = max( 1, batch_size // self.value_size )
+
+        self.width = width
+        self.row_size = self.value_size * width
+        # the format of a row is made once and repeated for all the rows of a block
+        self.row_format = ' '.join( [value_format] * width ) + '   %8.8x   %s\n'
+
+    def formatRows( self, buf, offset ):
+        rows = len(buf) // self.row_size
+
+        all_values = array.array( self.code )
+        all_values.frombytes( buf )
+        if self.byteswap:
+            all_values.byteswap()
+
+        text = buf.translate( printable_table ).decode( 'ascii' )
+
+        # the values of each row followed by its offset and text
+        all_values = all_values.tolist()
+        columns = self.width + 2
+        all_row_values = [None] * (rows * columns)
+        for index in range( self.width ):
+            all_row_values[index::columns] = all_values[index::self.width]
+
+        all_row_values[self.width::columns] = range( offset, offset + len(buf), self.row_size )
+        all_row_values[self.width + 1::columns] = [text[index:index + self.row_size] for index in range( 0, len(text), self.row_size )]
+
+        return ((self.row_format * rows) % tuple( all_row_values )).encode( 'ascii' )
+
+class DumpWriter:
+    '''
+    write the rows of a dump, in squeeze mode a row that is the same as the
+    row before is not written, a * line is written in place of them
+    '''
+    def __init__( self, output_file, squeeze, layout ):
+        self.output_file = output_file
+        self.squeeze = squeeze
+        self.layout = layout
+        self.row_size = layout.row_size
+
+        # the last row of the dump and if it was replaced by *
+        self.last_row = None
+        self.squeezing = False
+
+    def writeRows( self, buf, offset ):
+        if not self.squeeze:
+            self.output_file.write( self.layout.formatRows( buf, offset ) )
+            return
+
+        rows = len(buf) // self.row_size
+        if self.last_row is not None and buf == self.last_row * rows:
+            self._squeezeRow()
+            return
+
+        # the bytes of a row that is the same as the row before are all zero in differences.
+        # The zeros may also span two rows that are not the same
+        differences = (int.from_bytes( buf[self.row_size:], 'big' ) ^ int.from_bytes( buf[:-self.row_size], 'big' )).to_bytes( len(buf) - self.row_size, 'big' )
+        if buf[:self.row_size] != self.last_row and differences.find( bytes( self.row_size ) ) < 0:
+            # there is nothing to squeeze
+            self.output_file.write( self.layout.formatRows( buf, offset ) )
+            self.last_row = buf[-self.row_size:]
+            self.squeezing = False
+            return
+
+        all_rows = [buf[index:index + self.row_size] for index in range( 0, len(buf), self.row_size )]
+        # write the runs of rows that are not squeezed
+        run_start = None
+        for index, row in enumerate( all_rows ):
+            if row == self.last_row:
+                if run_start is not None:
+                    self.output_file.write( self.layout.formatRows( buf[run_start * self.row_size:index * self.row_size], offset + run_start * self.row_size ) )
+                    run_start = None
+
+                self._squeezeRow()
+
+            else:
+                if run_start is None:
+                    run_start = index
+
+                self.last_row = row
+                self.squeezing = False
+
+        if run_start is not None:
+            self.output_file.write( self.layout.formatRows( buf[run_start * self.row_size:], offset + run_start * self.row_size ) )
+
+    def writeHole( self, offset, length ):
+        # the rows of a hole are all zero and are not read from the file
+        if not self.squeeze:
+            # a hole at the end of the file may end part way through a row
+            length = (length + self.row_size - 1) // self.row_size * self.row_size
+            rows_block_size = rowsBlockSize( self.row_size )
+            zeros = bytes( min( length, rows_block_size ) )
+            for start in range( offset, offset + length, rows_block_size ):
+                self.writeRows( zeros[:min( rows_block_size, offset + length - start )], start )
+
+            return
+
+        self.output_file.write( ('* hole %8.8x-%8.8x\n' % (offset, offset + length)).encode( 'ascii' ) )
+        self.last_row = bytes( self.row_size )
+        self.squeezing = True
+
+    def finish( self, end ):
+        # like hexdump the offset of the end is written when the dump ends in
+        # a * line so that the length of the squeezed rows can be seen.
+        # The rows after this are not squeezed into the rows before it
+        if self.squeezing:
+            self.output_file.write( ('%8.8x\n' % (end,)).encode( 'ascii' ) )
+
+        self.last_row = None
+        self.squeezing = False
+
+    def _squeezeRow( self ):
+        if not self.squeezing:
+            self.output_file.write( b'*\n' )
+            self.squeezing = True
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv ) )
@@ -7,6 +7,7 @@ for tool in \
     colour_filter \
     ssh_wait \
     smart_find \
+    dump \
     ;
 do
     if ${tool}/run-test.sh ${PY}
@@ -16,3 +17,10 @@ do
         "${PY}" -m colour_text "<>red FAILED<> ${PY} ${tool}"
     fi
 done
+
+if "${PY}" startup-benchmark.py
+then
+    "${PY}" -m colour_text "<>green PASSED<> ${PY} startup-benchmark"
+else
+    "${PY}" -m colour_text "<>red FAILED<> ${PY} startup-benchmark"
+fi
@@ -2,9 +2,7 @@
 # coding: utf-8
 from __future__ import print_function
 import sys
-import platform
 import os
-import subprocess
 import json
 from config_path import ConfigPath  # type: ignore
 
@@ -235,6 +233,8 @@ class SmartFind:
             # turn kill to end of line in the output with ne
             # fn=:ln=:se=99 marks the : with \e[99m:\e[m
             os.environ['GREP_COLORS'] = 'ne:fn=:ln=:se=99'
+            # subprocess is only needed to read grep's output
+            import subprocess
             p = subprocess.Popen( cmd, stdin=None, stderr=subprocess.STDOUT, stdout=subprocess.PIPE )
             try:
                 while True:
@@ -245,7 +245,7 @@ class SmartFind:
                     line = line.decode( 'utf-8' )
 
                     # print( 'line: %r' % (line,) )
-                    if platform.mac_ver()[0] != '':
+                    if sys.platform == 'darwin':
                         # mac grep is not as configurable as gnu grep
                         parts = line.split( ':', 2 )
 
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+'''
+    startup-benchmark - measure how long each CLI takes to run a command
+    that does little work and check it against the budget in startup-budget.json
+
+    Each entry point is run in a new python process and the time of
+    an empty python process is taken away, leaving the cost of the
+    imports and of the work main() does before it gets going, such as
+    loading configs and caches. The number of modules imported is also
+    counted as it does not depend on how busy the machine is.
+'''
+import sys
+import os
+import json
+import time
+import tempfile
+import subprocess
+
+# the package of each CLI entry point and the args of a run that
+# only needs this computer
+all_entry_points = [
+    ('colour_text', ['<>info Info:<> startup']),
+    ('colour_filter', ['-s', 'startup']),
+    ('smart_find', ['*.py']),
+    ('ssh_wait', ['--help']),
+    ('update_linux', ['--list-hosts', 'localhost']),
+    ]
+
+# run once before the measurements to create the configs and caches
+all_setup_commands = [
+    ('colour_filter', ['-a', '-s', 'startup', 'ERROR', 'red']),
+    ('update_linux', ['--list-hosts', 'localhost']),
+    ]
+
+# allowed increase over the measured time when the budget is updated
+budget_margin = 0.5
+# allow for the timer resolution and noise of very fast imports
+budget_slack_ms = 5.0
+
+def usage():
+    print( '''Usage: startup-benchmark.py <options>
+
+Options:
+    --repeat <count>        - best of <count> runs of each entry point, default 10
+    --budget <file>         - the budget file, default startup-budget.json
+    --update-budget         - save the measured times and module counts as the budget
+    --importtime <dir>      - save the python -X importtime report of each entry point in <dir>
+
+Exits with 1 when any entry point is over its budget.
+''' )
+
+def main( argv ):
+    root_dir = os.path.dirname( os.path.abspath( __file__ ) )
+
+    opt_repeat = 10
+    opt_budget = os.path.join( root_dir, 'startup-budget.json' )
+    opt_update_budget = False
+    opt_importtime = None
+
+    args = iter( argv[1:] )
+    try:
+        for arg in args:
+            if arg == '--repeat':
+                opt_repeat = int( next( args ) )
+
+            elif arg == '--budget':
+                opt_budget = next( args )
+
+            elif arg == '--update-budget':
+                opt_update_budget = True
+
+            elif arg == '--importtime':
+                opt_importtime = next( args )
+
+            elif arg in ('-h', '--help'):
+                usage()
+                return 0
+
+            else:
+                print( 'Error: Unknown option %s' % (arg,) )
+                return 1
+
+    except (StopIteration, ValueError):
+        print( 'Error: Need more args' )
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict( os.environ )
+        # import the packages in this tree
+        all_paths = [os.path.join( root_dir, package, 'src' ) for package, all_args in all_entry_points]
+        if env.get( 'PYTHONPATH', '' ) != '':
+            all_paths.append( env['PYTHONPATH'] )
+
+        env['PYTHONPATH'] = os.pathsep.join( all_paths )
+        # the .pyc files must be used otherwise the time to compile the source is measured
+        env.pop( 'PYTHONDONTWRITEBYTECODE', None )
+        # no config from the user's home
+        env['HOME'] = tmp_dir
+        env['XDG_CONFIG_HOME'] = tmp_dir
+
+        for package, all_args in all_setup_commands:
+            runPython( env, tmp_dir, ['-m', package] + all_args )
+
+        base_seconds = bestOf( opt_repeat, lambda: runPython( env, tmp_dir, ['-c', 'pass'] ) )
+        base_modules = moduleCount( env, tmp_dir, None, [] )
+        print( 'python startup %.1fms %d modules' % (base_seconds * 1000, base_modules) )
+
+        results = {}
+        for package, all_args in all_entry_points:
+            cmd = ['-m', package] + all_args
+            # the first run writes the .pyc files
+            runPython( env, tmp_dir, cmd )
+
+            seconds = bestOf( opt_repeat, lambda: runPython( env, tmp_dir, cmd ) )
+            results[ package ] = {
+                'run_ms': max( 0.0, (seconds - base_seconds) * 1000 ),
+                'modules': moduleCount( env, tmp_dir, package, all_args ) - base_modules,
+                }
+
+            if opt_importtime is not None:
+                os.makedirs( opt_importtime, exist_ok=True )
+                saveImportTime( env, tmp_dir, cmd, os.path.join( opt_importtime, '%s.txt' % (package,) ) )
+
+    if opt_update_budget:
+        budget = {}
+        for package, result in results.items():
+            budget[ package ] = {
+                'run_ms': round( result['run_ms'] * (1 + budget_margin) + budget_slack_ms, 1 ),
+                'modules': result['modules'],
+                }
+
+        with open( opt_budget, 'w' ) as f:
+            json.dump( budget, f, indent=4 )
+            f.write( '\n' )
+
+        report( results, budget )
+        print( 'Budget saved in %s' % (opt_budget,) )
+        return 0
+
+    with open( opt_budget ) as f:
+        budget = json.load( f )
+
+    if not report( results, budget ):
+        return 1
+
+    return 0
+
+def bestOf( repeat, function ):
+    return min( function() for index in range( repeat ) )
+
+def runPython( env, cwd, all_args ):
+    # return the seconds python takes to run with all_args
+    start_time = time.perf_counter()
+    subprocess.run( [sys.executable] + all_args, env=env, cwd=cwd, check=True,
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL )
+    return time.perf_counter() - start_time
+
+def moduleCount( env, cwd, package, all_args ):
+    # return the number of modules loaded by a run of the __main__ of package,
+    # runpy is what python -m uses. The count is written to a file as the
+    # command uses stdout and stderr
+    count_filename = os.path.join( cwd, 'module-count.txt' )
+    code = 'import sys, runpy\n'
+    if package is not None:
+        code += ('sys.argv = [%r] + %r\n'
+                 'try:\n'
+                 '    runpy.run_module( %r, run_name="__main__", alter_sys=True )\n'
+                 'except SystemExit:\n'
+                 '    pass\n') % (package, all_args, package)
+
+    code += 'open( %r, "w" ).write( str( len( sys.modules ) ) )\n' % (count_filename,)
+    runPython( env, cwd, ['-c', code] )
+
+    with open( count_filename ) as f:
+        return int( f.read() )
+
+def saveImportTime( env, cwd, all_args, filename ):
+    cmd = [sys.executable, '-X', 'importtime'] + all_args
+    with open( filename, 'w' ) as f:
+        subprocess.run( cmd, env=env, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=f, check=True )
+
+def report( results, budget ):
+    # print the results against the budget, return False if any are over budget
+    all_ok = True
+    for package, result in results.items():
+        package_budget = budget.get( package )
+        if package_budget is None:
+            print( '%-15s %6.1fms %4d modules no budget' % (package, result['run_ms'], result['modules']) )
+            continue
+
+        all_over = []
+        if result['run_ms'] > package_budget['run_ms']:
+            all_over.append( 'time' )
+
+        if result['modules'] > package_budget['modules']:
+            all_over.append( 'modules' )
+
+        print( '%-15s %6.1fms of %6.1fms %4d of %4d modules %s' %
+                (package
+                ,result['run_ms'], package_budget['run_ms']
+                ,result['modules'], package_budget['modules']
+                ,'OVER BUDGET: %s' % (', '.join( all_over ),) if len(all_over) > 0 else 'ok') )
+
+        if len(all_over) > 0:
+            all_ok = False
+
+    return all_ok
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv ) )
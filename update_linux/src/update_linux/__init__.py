@@ -1,11 +1,8 @@
 import sys
 import os
 import datetime
-import subprocess
 import time
 import socket
-import platform
-import tempfile
 import json
 from config_path import ConfigPath  # type: ignore
 
@@ -18,9 +15,17 @@ default_json_config_template = u'''{
 }
 '''
 
+def defaultJsonConfig():
+    # tempfile is slow to import and only needed when there is no logdir in the config
+    import tempfile
+
+    return default_json_config_template % {
+                'logdir': tempfile.gettempdir()
+                }
+
 from pathlib import Path
 
-from colour_text import ColourText
+from colour_text import ColourText, ColourWriter
 from ssh_wait import ssh_wait
 
 class OptionError(Exception):
@@ -154,10 +159,16 @@ class UpdateFedora:
 
         self.ct = ColourText()
         self.ct.initTerminal()
+        self.ct.detectColour()
         self.ct.define( 'host', 'lightblue' )
         self.ct.define( 'proc', 'magenta' )
         self.ct.define( 'file', 'magenta' )
 
+        # the log lines are written to stdout and, without colour, to the summary log.
+        # debug lines and the output of commands are only written to stdout
+        self.log_writer = ColourWriter( self.ct )
+        self.log_writer.addTarget( sys.stdout, colour=self.ct.colour )
+
         t = datetime.datetime.now()
         self.ts = t.strftime( '%Y-%m-%d' )
         self.summary_log_name = None
@@ -180,6 +191,9 @@ class UpdateFedora:
         if not self.loadConfig():
             return 1
 
+        # write the waiting log lines before the lines printed below
+        self.log_writer.flush()
+
         if self.opt_help:
             print(
 '''Usage: %(appname)s <options> <group>|<host>|--self...
@@ -250,48 +264,54 @@ For help:
         self.summary_log_name = self.logdir / ('update-summary-%s.log' % (self.ts,))
 
         with open( self.summary_log_name, 'a' ) as self.summary_log:
-            t = datetime.datetime.now()
-            self.header( 'Update summary %s' % (t.strftime( '%Y-%m-%d %H:%M:%S' ),) )
+            self.log_writer.addTarget( self.summary_log, colour=False )
+            try:
+                t = datetime.datetime.now()
+                self.header( 'Update summary %s' % (t.strftime( '%Y-%m-%d %H:%M:%S' ),) )
 
-            for host in self.all_hosts:
-                if host in all_to_exclude:
-                    continue
+                for host in self.all_hosts:
+                    if host in all_to_exclude:
+                        continue
 
-                os_plugin_type, os_id, os_version = self.detectOperatingSystem( host )
-                if os_plugin_type is None:
-                    if os_id is not None:
-                        self.warn( host, 'Unsupported OS type %s %s' % (os_id, os_version) )
-                    continue
+                    os_plugin_type, os_id, os_version = self.detectOperatingSystem( host )
+                    if os_plugin_type is None:
+                        if os_id is not None:
+                            self.warn( host, 'Unsupported OS type %s %s' % (os_id, os_version) )
+                        continue
 
-                self.info( host, 'OS is %s %s. Using OS plugin %s' % (os_id, os_version, os_plugin_type) )
+                    self.info( host, 'OS is %s %s. Using OS plugin %s' % (os_id, os_version, os_plugin_type) )
 
-                plugin = os_id_to_plugin[ os_plugin_type ]( self )
+                    plugin = os_id_to_plugin[ os_plugin_type ]( self )
 
-                self.flushDns()
-                if self.opt_check:
-                    plugin.check( host,
-                        check_log_name=self.logdir / ('check-update-%s-%s.log' % (host or 'localhost', self.ts)) )
+                    self.flushDns()
+                    if self.opt_check:
+                        plugin.check( host,
+                            check_log_name=self.logdir / ('check-update-%s-%s.log' % (host or 'localhost', self.ts)) )
 
-                elif self.opt_install_package() is not None:
-                    plugin.installPackage( host, self.opt_install_package(),
-                        install_log_name=self.logdir / ('install-%s-%s.log' % (host or 'localhost', self.ts)) )
+                    elif self.opt_install_package() is not None:
+                        plugin.installPackage( host, self.opt_install_package(),
+                            install_log_name=self.logdir / ('install-%s-%s.log' % (host or 'localhost', self.ts)) )
 
-                else:
-                    if host is not None and self.isThisHost( host ):
-                        self.warn( host, 'Refusing to update this host' )
+                    else:
+                        if host is not None and self.isThisHost( host ):
+                            self.warn( host, 'Refusing to update this host' )
 
-                    elif self.opt_system_upgrade:
-                        plugin.systemUpgrade( host, self.opt_system_upgrade(),
-                            upgrade_log_name=self.logdir / ('upgrade-%s-%s.log' % (host or 'localhost', self.ts)) )
+                        elif self.opt_system_upgrade:
+                            plugin.systemUpgrade( host, self.opt_system_upgrade(),
+                                upgrade_log_name=self.logdir / ('upgrade-%s-%s.log' % (host or 'localhost', self.ts)) )
 
-                    elif self.opt_update:
-                        plugin.update( host,
-                            update_log_name=self.logdir / ('update-%s-%s.log' % (host or 'localhost', self.ts)),
-                            status_log_name=self.logdir / ('status-%s-%s.log' % (host or 'localhost', self.ts)) )
+                        elif self.opt_update:
+                            plugin.update( host,
+                                update_log_name=self.logdir / ('update-%s-%s.log' % (host or 'localhost', self.ts)),
+                                status_log_name=self.logdir / ('status-%s-%s.log' % (host or 'localhost', self.ts)) )
 
-                    else:
-                        self.error( host, 'What action do you wish performed? --check --update or --system-upgrade' )
-                        return 1
+                        else:
+                            self.error( host, 'What action do you wish performed? --check --update or --system-upgrade' )
+                            return 1
+
+            finally:
+                self.log_writer.removeTarget( self.summary_log )
+                self.summary_log = None
 
         if not self.opt_check:
             print( '-' * 60 )
@@ -337,11 +357,8 @@ For help:
     def loadConfig( self ):
         self.config = ConfigPath( 'update-linux', 'barrys-emacs.org', '.json' )
         config_file = self.config.readFilePath()
-        default_json_config = default_json_config_template % {
-                        'logdir': tempfile.gettempdir()
-                        }
         if config_file is None:
-            json_config = default_json_config
+            json_config = defaultJsonConfig()
             self.debug( 'Using default builtin config' )
             config_file = self.config.saveFilePath( True )
             self.info( '', 'Creating default config in %s' % (config_file,) )
@@ -355,7 +372,6 @@ For help:
             with open(config_file) as f:
                 json_config = f.read()
 
-        defaults = json.loads( default_json_config )
         try:
             user = json.loads( json_config )
 
@@ -363,19 +379,19 @@ For help:
             self.error( config_file, e )
             return False
 
-        def getConfigSetting( name, user, defaults ):
+        def getConfigSetting( name, user ):
             if name in user:
                 return user[name]
             else:
-                return defaults[name]
+                return json.loads( defaultJsonConfig() )[name]
 
-        self.all_groups = getConfigSetting( 'group', user, defaults )
-        self.logdir = Path( getConfigSetting( 'logdir', user, defaults ) ).expanduser()
+        self.all_groups = getConfigSetting( 'group', user )
+        self.logdir = Path( getConfigSetting( 'logdir', user ) ).expanduser()
 
         return True
 
     def flushDns( self ):
-        if platform.mac_ver()[0] == '':
+        if sys.platform != 'darwin':
             return
 
         # mac often needs its DNS cache flushing as it will
@@ -411,7 +427,7 @@ For help:
             if line.startswith('@@@'):
                 self.warn( host, 'ssh warning detected - please fix' )
                 for line in stdout:
-                    print( self.ct( '<>proc %s<>: %s' % (host or 'localhost', line.rstrip()) ) )
+                    self.log_writer.renderLine( '<>proc %s<>: %s', host or 'localhost', line.rstrip(), target=sys.stdout )
 
                 return None, None, None
 
@@ -482,7 +498,7 @@ For help:
 
         if len(stdout) < 1 and not stdout[0].startswith( '0 loaded units listed.' ):
             for line in stdout:
-                print( self.ct( '<>proc %s<>: %s' % (host or 'localhost', line.rstrip()) ) )
+                self.log_writer.renderLine( '<>proc %s<>: %s', host or 'localhost', line.rstrip(), target=sys.stdout )
 
             self.error( host, 'Some services failed' )
             return False
@@ -517,6 +533,9 @@ For help:
         if log:
             self.info( host, 'Run command: %s' % (' '.join( cmd ),) )
 
+        # subprocess is not needed by --help and --list-hosts
+        import subprocess
+
         stdout = []
         p = subprocess.Popen( cmd, stderr=subprocess.STDOUT, stdout=subprocess.PIPE )
         while True:
@@ -526,7 +545,7 @@ For help:
 
             line = line.decode( 'utf-8' )
             if log:
-                print( self.ct( '<>proc %s<>: %s' % (host or 'localhost', line.rstrip()) ) )
+                self.log_writer.renderLine( '<>proc %s<>: %s', host or 'localhost', line.rstrip(), target=sys.stdout )
 
             stdout.append( line )
 
@@ -542,29 +561,28 @@ For help:
     # log functions
     def debug( self, msg ):
         if self.opt_debug:
-            print( self.ct( '<>red Debug:<> %s' % (msg,) ), flush=True )
+            self.log_writer.renderLine( '<>red Debug:<> %s', msg, important=True, target=sys.stdout )
 
     def info( self, host, msg ):
         self._log( '<>info %(TIME)s<> <>host %(HOST)10s<> %(MSG)s', host or 'localhost', msg )
 
     def error( self, host, msg ):
-        self._log( '<>error %(TIME)s<> <>host %(HOST)10s<> <>error %(MSG)s<>', host or 'localhost', msg )
+        self._log( '<>error %(TIME)s<> <>host %(HOST)10s<> <>error %(MSG)s<>', host or 'localhost', msg, important=True )
 
     def warn( self, host, msg ):
-        self._log( '<>em %(TIME)s<> <>host %(HOST)10s<> <>em %(MSG)s<>', host or 'localhost', msg )
+        self._log( '<>em %(TIME)s<> <>host %(HOST)10s<> <>em %(MSG)s<>', host or 'localhost', msg, important=True )
 
     def header( self, msg ):
         self._log( '<>em %(MSG)s<>', '', msg )
 
-    def _log( self, fmt, host, msg ):
+    def _log( self, fmt, host, msg, important=False ):
         t = datetime.datetime.now()
-        log_line = self.ct( fmt % {'HOST': host
-                                  ,'TIME': t.strftime( '%H:%M:%S' )
-                                  ,'MSG': msg} )
-        print( log_line, flush=True )
+        log_text = fmt % {'HOST': host
+                         ,'TIME': t.strftime( '%H:%M:%S' )
+                         ,'MSG': msg}
+        self.log_writer.writeLine( log_text, important=important )
         if self.summary_log is not None:
-            print( log_line, file=self.summary_log, flush=True )
-            self.all_summary_lines.append( log_line )
+            self.all_summary_lines.append( self.ct( log_text ) )
 
 class UpdatePluginFedora:
     def __init__( self, app ):
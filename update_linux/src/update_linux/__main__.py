@@ -2,8 +2,14 @@ import sys
 import update_linux
 
 def main():
+    app = update_linux.UpdateFedora()
     try:
-        sys.exit( update_linux.UpdateFedora().main( sys.argv ) )
+        try:
+            sys.exit( app.main( sys.argv ) )
+
+        finally:
+            # write the waiting log lines before any message below
+            app.log_writer.flush()
 
     except KeyboardInterrupt:
         print()